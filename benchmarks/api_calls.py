@@ -0,0 +1,279 @@
+import argparse
+import contextlib
+import io
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+import warnings
+
+import boto3
+from botocore import xform_name
+from moto import mock_aws
+from moto.cloudformation import parsing
+from moto.core.common_models import CloudFormationModel
+from moto.core.responses import ActionResult
+from moto.ec2.responses import EC2Response
+from moto.ec2.models.instances import Instance
+from moto.ec2.models.route_tables import RouteTable
+from moto.ec2.models.subnets import Subnet
+from moto.ec2.utils import random_public_ip
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'api_calls_baseline.json')
+
+DEPLOYMENT_TYPES = ['simple', 'vpc', 'secure']
+USER = 'benchmark'
+PEDL_VERSION = '0.0.1'
+# moto only offers the current GPU generations, the default p2.8xlarge would fail the preflight check. The VPC and
+# secure agents launch in the first zone, which has no p3dn.24xlarge in moto.
+AGENT_INSTANCE_TYPE = 'p4d.24xlarge'
+
+# Each operation runs against the state left by the one before it, so the update finds the stack unchanged
+# and the second user finds the shared network in place
+OPERATIONS = {
+    'deploy': [],
+    'update': [],
+    'second user': ['--user', f'{USER}-2'],
+    'status': ['--status', '--all'],
+    'delete': ['--delete'],
+}
+
+
+class DBCluster(CloudFormationModel):
+    # moto has no CloudFormation model for Aurora clusters. The templates only read the endpoint address,
+    # so a placeholder resource is enough. moto derives the service from the module name.
+    __module__ = 'benchmarks.api_calls'
+
+    def __init__(self, name):
+        self.name = name
+
+    @staticmethod
+    def cloudformation_type():
+        return 'AWS::RDS::DBCluster'
+
+    @staticmethod
+    def cloudformation_name_type():
+        return 'DBClusterIdentifier'
+
+    @classmethod
+    def create_from_cloudformation_json(cls, resource_name, cloudformation_json, account_id, region_name,
+                                        **kwargs):
+        return cls(resource_name)
+
+    @property
+    def physical_resource_id(self):
+        return self.name
+
+    @classmethod
+    def has_cfn_attr(cls, attr):
+        return attr in ['Endpoint.Address', 'Endpoint.Port']
+
+    def get_cfn_attribute(self, attribute_name):
+        if attribute_name == 'Endpoint.Port':
+            return '5432'
+        return f'{self.name}.cluster.localhost'
+
+
+def fast_snapshot_restores(response):
+    if not hasattr(response.ec2_backend, 'fast_snapshot_restores'):
+        response.ec2_backend.fast_snapshot_restores = set()
+    return response.ec2_backend.fast_snapshot_restores
+
+
+def describe_fast_snapshot_restores(self):
+    filters = self._filters_from_querystring()
+    restores = [{'SnapshotId': snapshot_id, 'AvailabilityZone': zone, 'State': 'enabled'}
+                for snapshot_id, zone in sorted(fast_snapshot_restores(self))
+                if snapshot_id in filters.get('snapshot-id', [snapshot_id]) and
+                'enabled' in filters.get('state', ['enabled'])]
+    return ActionResult({'FastSnapshotRestores': restores})
+
+
+def change_fast_snapshot_restores(enabled):
+    def change(self):
+        restores = fast_snapshot_restores(self)
+        changed = []
+        for snapshot_id in self._get_param('SourceSnapshotIds', []):
+            for zone in self._get_param('AvailabilityZones', []):
+                (restores.add if enabled else restores.discard)((snapshot_id, zone))
+                changed.append({'SnapshotId': snapshot_id, 'AvailabilityZone': zone,
+                                'State': 'enabling' if enabled else 'disabling'})
+        return ActionResult({'Successful': changed, 'Unsuccessful': []})
+    return change
+
+
+def configure_stand_in():
+    # Close the gaps in moto's CloudFormation support that the PEDL templates run into
+    parsing.get_model_list.cache_clear()
+    parsing.get_model_map.cache_clear()
+
+    create_subnet = Subnet.create_from_cloudformation_json.__func__
+
+    def create_subnet_with_public_ips(cls, resource_name, cloudformation_json, account_id, region_name,
+                                      **kwargs):
+        subnet = create_subnet(cls, resource_name, cloudformation_json, account_id, region_name, **kwargs)
+        subnet.map_public_ip_on_launch = cloudformation_json['Properties'].get('MapPublicIpOnLaunch') is True
+        return subnet
+
+    Subnet.create_from_cloudformation_json = classmethod(create_subnet_with_public_ips)
+
+    create_instance = Instance.create_from_cloudformation_json.__func__
+
+    def create_instance_with_public_ip(cls, resource_name, cloudformation_json, account_id, region_name,
+                                       **kwargs):
+        instance = create_instance(cls, resource_name, cloudformation_json, account_id, region_name, **kwargs)
+        if instance.subnet_id and instance.ec2_backend.get_subnet(instance.subnet_id).map_public_ip_on_launch:
+            instance.nics[0].public_ip = instance.nics[0].public_ip or random_public_ip()
+        return instance
+
+    Instance.create_from_cloudformation_json = classmethod(create_instance_with_public_ip)
+
+    # Route tables are never deleted with their stack, which keeps the VPC from being deleted
+    RouteTable.delete = lambda self, account_id, region_name: self.ec2_backend.delete_route_table(self.id)
+
+    # moto has no fast snapshot restores, the stand-in enables them right away
+    EC2Response.describe_fast_snapshot_restores = describe_fast_snapshot_restores
+    EC2Response.enable_fast_snapshot_restores = change_fast_snapshot_restores(True)
+    EC2Response.disable_fast_snapshot_restores = change_fast_snapshot_restores(False)
+
+    # moto lints templates with cfn-lint and rejects them on warnings CloudFormation itself accepts
+    from moto.cloudformation.models import CloudFormationBackend
+    CloudFormationBackend.validate_template = lambda self, template: []
+
+    warnings.simplefilter('ignore')
+    logging.getLogger('moto').setLevel(logging.ERROR)
+
+
+def create_fixtures():
+    ec2 = boto3.client('ec2')
+    ec2.create_key_pair(KeyName='pedl-keypair')
+
+    base_image = ec2.describe_images()['Images'][0]['ImageId']
+    instance_id = ec2.run_instances(ImageId=base_image, MinCount=1, MaxCount=1)['Instances'][0]['InstanceId']
+    for role in ['master', 'agent']:
+        image_id = ec2.create_image(InstanceId=instance_id, Name=f'pedl-{role}-{PEDL_VERSION}')['ImageId']
+        ec2.create_tags(
+            Resources=[image_id],
+            Tags=[
+                {'Key': 'image_type', 'Value': 'release'},
+                {'Key': 'pedl-version', 'Value': PEDL_VERSION}
+            ]
+        )
+    ec2.terminate_instances(InstanceIds=[instance_id])
+
+
+def fresh_main():
+    # Every CLI run is a new process, so the in-process caches must not carry over between operations
+    for name in [name for name in sys.modules if name == 'pedl_deploy' or name.startswith('pedl_deploy.')]:
+        del sys.modules[name]
+
+    from pedl_deploy import clients, main
+    return clients, main
+
+
+def run_operation(argv):
+    clients, main = fresh_main()
+    calls = {}
+
+    def count_call(model, **kwargs):
+        operation = f'{model.service_model.service_name}.{xform_name(model.name)}'
+        calls[operation] = calls.get(operation, 0) + 1
+
+    clients.register_handler('before-call', count_call)
+
+    output = io.StringIO()
+    sys.argv = ['pedl-deploy'] + argv
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(output):
+        try:
+            main.main()
+            code = 0
+        except SystemExit as e:
+            code = e.code
+    elapsed = time.perf_counter() - start
+
+    if code:
+        print(output.getvalue())
+        raise RuntimeError(f'pedl-deploy {" ".join(argv)} exited with {code}')
+    return {'seconds': round(elapsed, 3), 'calls': dict(sorted(calls.items()))}
+
+
+def run_deployment_type(deployment_type):
+    results = {}
+    with tempfile.TemporaryDirectory() as home, mock_aws():
+        os.environ['HOME'] = home
+        create_fixtures()
+        for operation, extra_args in OPERATIONS.items():
+            argv = ['--deployment-type', deployment_type, '--user', USER,
+                    '--agent-instance-type', AGENT_INSTANCE_TYPE] + extra_args
+            results[f'{deployment_type} {operation}'] = run_operation(argv)
+    return results
+
+
+def compare(result, baseline, tolerance, slack):
+    problems = []
+    if baseline is None:
+        return ['no baseline']
+
+    for operation, count in result['calls'].items():
+        expected = baseline['calls'].get(operation, 0)
+        if count > expected:
+            problems.append(f'{operation} {expected} -> {count}')
+
+    allowed = baseline['seconds'] * tolerance + slack
+    if result['seconds'] > allowed:
+        problems.append(f'{result["seconds"]:.2f}s over {allowed:.2f}s')
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Count the AWS API calls and time of pedl-deploy against moto')
+    parser.add_argument('--tolerance', type=float, default=1.5,
+                        help='allowed factor on the baseline wall time')
+    parser.add_argument('--slack', type=float, default=0.5,
+                        help='seconds allowed on top of the baseline wall time for the noise of moto')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    os.environ.update({
+        'AWS_ACCESS_KEY_ID': 'testing',
+        'AWS_SECRET_ACCESS_KEY': 'testing',
+        'AWS_DEFAULT_REGION': 'us-east-1',
+    })
+    os.environ.pop('AWS_PROFILE', None)
+    sys.path.insert(0, REPO_ROOT)
+    configure_stand_in()
+
+    results = {}
+    for deployment_type in DEPLOYMENT_TYPES:
+        results.update(run_deployment_type(deployment_type))
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(results, f, indent=2)
+            f.write('\n')
+
+    baselines = {}
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+
+    failed = False
+    for name, result in results.items():
+        problems = compare(result, baselines.get(name), args.tolerance, args.slack)
+        status = 'ok'
+        if problems:
+            status = f'FAILED ({", ".join(problems)})'
+            failed = True
+        print(f'{name:<20} {result["seconds"] * 1000:8.1f} ms  {sum(result["calls"].values()):4} calls  {status}')
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+# Runs the CLI in a fresh interpreter and reports whether boto3 ended up imported
+CLI_SNIPPET = '''
+import sys
+from pedl_deploy.main import main
+try:
+    main()
+except BaseException:
+    pass
+print('boto3 imported' if 'boto3' in sys.modules else 'boto3 not imported')
+'''
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CASES = {
+    'help': ['--help'],
+    'invalid argument': ['--max-workers', 'not-a-number'],
+    'invalid deployment type': ['--deployment-type', 'not-a-type'],
+}
+
+
+def run(argv):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', CLI_SNIPPET] + argv, capture_output=True, text=True,
+                            cwd=REPO_ROOT)
+    return time.perf_counter() - start, result.stdout.strip().splitlines()[-1:]
+
+
+def bare_start():
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'])
+    return time.perf_counter() - start
+
+
+def median_time(argv, runs):
+    times, last_lines = [], []
+    for _ in range(runs):
+        elapsed, last_lines = run(argv)
+        times.append(elapsed)
+    return statistics.median(times), last_lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Guard the cold start time of pedl-deploy')
+    parser.add_argument('--runs', type=int, default=10,
+                        help='runs per case, the median is reported')
+    parser.add_argument('--budget', type=float, default=0.15,
+                        help='allowed seconds on top of a bare interpreter start')
+    args = parser.parse_args()
+
+    interpreter = statistics.median(bare_start() for _ in range(args.runs))
+    print(f'{"bare interpreter":<24} {interpreter * 1000:7.1f} ms')
+
+    failed = False
+    for name, argv in CASES.items():
+        elapsed, last_lines = median_time(argv, args.runs)
+        overhead = elapsed - interpreter
+        status = 'ok'
+        if last_lines != ['boto3 not imported']:
+            status = 'FAILED (boto3 imported)'
+            failed = True
+        elif overhead > args.budget:
+            status = f'FAILED (over budget of {args.budget * 1000:.0f} ms)'
+            failed = True
+        print(f'{name:<24} {elapsed * 1000:7.1f} ms  (+{overhead * 1000:.1f} ms)  {status}')
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+import argparse
+import difflib
+import os
+import sys
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'templates_baseline')
+TEMPLATE_DIR = os.path.join(REPO_ROOT, 'pedl_deploy', 'templates')
+
+
+def template_names():
+    return sorted(name for name in os.listdir(TEMPLATE_DIR) if name.endswith('.yaml'))
+
+
+def compare(name, rendered):
+    # The whole rendered template, so a change in the components shows up in every template it reaches
+    path = os.path.join(BASELINE_DIR, name)
+    if not os.path.exists(path):
+        return ['no baseline']
+    with open(path) as f:
+        baseline = f.read()
+    return list(difflib.unified_diff(baseline.splitlines(), rendered.splitlines(), f'baseline/{name}',
+                                     f'rendered/{name}', lineterm=''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the rendered templates of pedl-deploy with the baseline')
+    parser.add_argument('--update-baseline', action='store_true',
+                        help='store the rendered templates as the new baseline')
+    args = parser.parse_args()
+
+    sys.path.insert(0, REPO_ROOT)
+    from pedl_deploy import templating
+
+    rendered = {name: templating.render_template(name) for name in template_names()}
+
+    if args.update_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        for name, text in rendered.items():
+            with open(os.path.join(BASELINE_DIR, name), 'w') as f:
+                f.write(text)
+
+    failed = False
+    for name, text in rendered.items():
+        problems = compare(name, text)
+        print(f'{name:<20} {"FAILED" if problems else "ok"}')
+        for line in problems:
+            print(f'  {line}')
+        failed = failed or bool(problems)
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+import json
+import os
+import time
+
+from pedl_deploy.aws import get_caller_identity
+from pedl_deploy.clients import client
+from pedl_deploy.constants import ami_catalog, misc
+
+
+def image_role(image):
+    for role in ami_catalog.ROLES:
+        if role in image['Name']:
+            return role
+    return None
+
+
+def image_version(image):
+    for tag in image.get('Tags', []):
+        if tag['Key'] == ami_catalog.VERSION_TAG:
+            return tag['Value']
+    return None
+
+
+def build_index(images):
+    # Maps pedl-version -> role -> newest image of that role, built in a single pass
+    index = {}
+    for image in images:
+        role, version = image_role(image), image_version(image)
+        if role is None or version is None:
+            continue
+
+        current = index.setdefault(version, {}).get(role)
+        if current is None or image['CreationDate'] > current['CreationDate']:
+            index[version][role] = {
+                'ImageId': image['ImageId'],
+                'CreationDate': image['CreationDate']
+            }
+    return index
+
+
+def cache_path(boto3_session):
+    account = get_caller_identity(boto3_session)['Account']
+    return os.path.join(os.path.expanduser(misc.CACHE_DIR), f'amis-{account}-{boto3_session.region_name}.json')
+
+
+def load_index(path):
+    try:
+        with open(path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    # A cache written by another version or cut short is a miss, like one that does not parse
+    if not isinstance(cached, dict) or not isinstance(cached.get('created'), (int, float)) or \
+            not isinstance(cached.get('index'), dict):
+        return None
+    if time.time() - cached['created'] > ami_catalog.CACHE_TTL:
+        return None
+    return cached['index']
+
+
+def save_index(path, index):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'created': time.time(), 'index': index}, f)
+    os.replace(tmp_path, path)
+
+
+def describe_release_images(boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+
+    response = ec2.describe_images(
+        Filters=[
+            {
+                'Name': 'tag:image_type',
+                'Values': [
+                    'release',
+                ]
+            },
+        ],
+
+        Owners=['self']
+    )
+    return response['Images']
+
+
+def get_index(boto3_session, pedl_version=None):
+    path = cache_path(boto3_session)
+    index = load_index(path)
+
+    # A pinned version missing from the cache, or cached with only one of its roles, may have been released since
+    # the cache was written
+    if index is None or (pedl_version and not set(ami_catalog.ROLES) <= set(index.get(pedl_version, {}))):
+        index = build_index(describe_release_images(boto3_session))
+        save_index(path, index)
+    return index
+
+
+def match_release_amis(index, pedl_version=None):
+    pairs = {version: roles for version, roles in index.items() if set(ami_catalog.ROLES) <= set(roles)}
+
+    if pedl_version:
+        if pedl_version not in pairs:
+            raise LookupError(f'No matching master and agent release AMIs found for pedl-version {pedl_version}')
+        version = pedl_version
+    else:
+        if not pairs:
+            raise LookupError('No matching master and agent release AMIs found')
+        version = max(pairs, key=lambda v: (max(image['CreationDate'] for image in pairs[v].values()), v))
+
+    return version, pairs[version]['master']['ImageId'], pairs[version]['agent']['ImageId']
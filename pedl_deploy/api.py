@@ -0,0 +1,362 @@
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+
+from pedl_deploy.constants import agent_scaling, cloudformation, defaults, deployment_types, network, pedl_config, \
+    readiness, timing, volumes
+from pedl_deploy.errors import ConfigError, MasterNotReadyError, StackError
+from pedl_deploy.options import deploy_options
+
+# The library behind the pedl-deploy CLI. Failures raise the errors of pedl_deploy.errors instead of exiting,
+# so one process can drive many deployments, and every call returns what it did. Like in the CLI, modules that
+# pull in boto3 are imported inside the functions that need them.
+
+_scope_lock = threading.Lock()
+# The calls running on a session, by id of the session
+_session_calls = {}
+
+
+@dataclass
+class DeployResult:
+    stack_name: str
+    region: str
+    deployment_type: str
+    # The operation submitted without waiting for it, None once the stack is deployed or planned
+    pending: dict = None
+    # Only the changes were shown, nothing was deployed
+    plan: bool = False
+    outputs: dict = field(default_factory=dict)
+    addresses: dict = field(default_factory=dict)
+    endpoint: str = None
+    # Seconds from the start of the deploy until the master served, with wait_ready and only for a new stack
+    ready_seconds: float = None
+    timings: dict = field(default_factory=dict)
+
+
+@dataclass
+class DeleteResult:
+    stack_name: str
+    region: str
+    pending: dict = None
+    timings: dict = field(default_factory=dict)
+
+
+def deployment_class(deployment_type):
+    if deployment_type == deployment_types.SECURE:
+        from pedl_deploy.deployment_types.secure import Secure
+        return Secure
+    if deployment_type == deployment_types.VPC:
+        from pedl_deploy.deployment_types.vpc import VPC
+        return VPC
+    if deployment_type == deployment_types.SIMPLE:
+        from pedl_deploy.deployment_types.simple import Simple
+        return Simple
+    raise ConfigError(f'deployment type - must be one of [{", ".join(deployment_types.DEPLOYMENT_TYPES)}]')
+
+
+def session(profile_name=None, region_name=None, client_factory=None):
+    # client_factory(boto3_session, service_name, region_name) creates the clients of the session, e.g. to share
+    # them with the rest of the process
+    from pedl_deploy.aws import session as new_session
+    from pedl_deploy.clients import set_factory
+
+    boto3_session = new_session(profile_name, region_name)
+    if client_factory:
+        set_factory(boto3_session, client_factory)
+    return boto3_session
+
+
+def get_user(boto3_session):
+    from pedl_deploy.aws import get_caller_identity
+
+    response = get_caller_identity(boto3_session)
+    return response['Arn'].split('/')[-1]
+
+
+@contextmanager
+def session_scope(boto3_session):
+    # The stacks, identity and clients kept for a session only live while calls on it run, so a long running
+    # process neither reads what earlier calls left behind nor holds on to every session it was handed
+    from pedl_deploy import aws, clients
+
+    key = id(boto3_session)
+    with _scope_lock:
+        if not _session_calls.get(key):
+            aws.forget_session(boto3_session)
+        _session_calls[key] = _session_calls.get(key, 0) + 1
+    try:
+        yield
+    finally:
+        with _scope_lock:
+            _session_calls[key] -= 1
+            if not _session_calls[key]:
+                del _session_calls[key]
+                aws.forget_session(boto3_session)
+                clients.clear(boto3_session)
+
+
+@contextmanager
+def timing_scope(region, stack_name):
+    # The timings of a deploy or delete start empty and are dropped once its result holds them
+    from pedl_deploy import timings
+
+    scopes = [timing.RUN_SCOPE, network.STACK_NAME, stack_name]
+    timings.clear(region, scopes)
+    try:
+        yield
+    finally:
+        timings.clear(region, scopes)
+
+
+def stack_timings(stack_name, region):
+    from pedl_deploy.timings import report
+
+    return report().get((region, stack_name), {})
+
+
+def configure(args):
+    # Fills in the agent and database settings, flags override the --agent-config file
+    from pedl_deploy.database import apply_database_config
+    from pedl_deploy.scaling import apply_agent_config
+
+    try:
+        apply_agent_config(args)
+        apply_database_config(args)
+    except (OSError, ValueError) as e:
+        raise ConfigError(str(e)) from e
+    return args
+
+
+def preflight(args, boto3_session, batch=False):
+    # Returns the master and agent amis and the agent instance type with its market
+    from pedl_deploy.preflight import run_preflight
+    from pedl_deploy.timings import phase
+
+    with phase(boto3_session.region_name, timing.RUN_SCOPE, 'preflight'):
+        return run_preflight(args, boto3_session, deployment_class(args.deployment_type), batch)
+
+
+def pedl_configs(args, user, master_ami, agent_ami, agents, boto3_session):
+    agent_instance_type, market = agents
+    return {
+        pedl_config.MASTER_AMI: master_ami,
+        pedl_config.AGENT_AMI: agent_ami,
+        pedl_config.KEYPAIR: args.keypair,
+        pedl_config.MASTER_INSTANCE_TYPE: args.master_instance_type,
+        pedl_config.AGENT_INSTANCE_TYPE: agent_instance_type,
+        pedl_config.MIN_AGENT_INSTANCES: args.min_agents,
+        pedl_config.MAX_AGENT_INSTANCES: args.max_agents,
+        pedl_config.MAX_IDLE_AGENT_PERIOD: args.max_idle_agent_period,
+        pedl_config.MASTER_VOLUME: args.master_volume,
+        pedl_config.AGENT_VOLUME: args.agent_volume,
+        pedl_config.AGENT_SPOT: market == agent_scaling.SPOT,
+        pedl_config.AGENT_FAST_SNAPSHOT_RESTORE: args.fast_snapshot_restore,
+        pedl_config.AGENT_PLACEMENT_GROUP: args.placement_group,
+        pedl_config.SAVE_EXPERIMENT_BEST: args.save_experiment_best,
+        pedl_config.SAVE_TRIAL_BEST: args.save_trial_best,
+        pedl_config.SAVE_TRIAL_LATEST: args.save_trial_latest,
+        pedl_config.CHECKPOINT_EXPIRATION_DAYS: args.checkpoint_expiration_days,
+        pedl_config.ABORT_MULTIPART_UPLOAD_DAYS: args.abort_multipart_upload_days,
+        pedl_config.DATABASE_INSTANCE_CLASS: args.db_instance_class or '',
+        pedl_config.DATABASE_MIN_CAPACITY: args.db_min_capacity,
+        pedl_config.DATABASE_MAX_CAPACITY: args.db_max_capacity,
+        pedl_config.DATABASE_AUTO_PAUSE: args.db_auto_pause,
+        pedl_config.USER: user,
+        pedl_config.PEDL_STACK_NAME: defaults.PEDL_STACK_NAME_BASE.format(user),
+        pedl_config.BOTO3_SESSION: boto3_session,
+        pedl_config.PLAN: args.plan,
+        pedl_config.WAIT: not args.no_wait,
+        pedl_config.WAIT_READY: args.wait_ready
+    }
+
+
+def wait_ready(deployment_object, stack_name, region, addresses, start):
+    from pedl_deploy.readiness import wait_until_serving
+    from pedl_deploy.timings import phase
+
+    url = deployment_object.ready_url(addresses)
+    if url is not None:
+        print(f'Waiting for the PEDL master of {stack_name} to serve {url}')
+        with phase(region, stack_name, 'ready'):
+            ready = wait_until_serving(url)
+        if not ready:
+            raise MasterNotReadyError(stack_name, f'The PEDL master of {stack_name} did not serve {url} within '
+                                                  f'{readiness.TIMEOUT}s')
+    return time.time() - start
+
+
+def deploy_stack(deployment_type, configs):
+    # Deploys the stack of the configs made by pedl_configs
+    from pedl_deploy.aws import describe_stack, get_ec2_info, get_output
+    from pedl_deploy.timings import phase
+
+    deployment_object = deployment_class(deployment_type)(configs)
+    stack_name = configs[pedl_config.PEDL_STACK_NAME]
+    boto3_session = configs[pedl_config.BOTO3_SESSION]
+    result = DeployResult(stack_name, boto3_session.region_name, deployment_type)
+    start = time.time()
+    # The time until the master serves only says something about a master the deploy started
+    created = describe_stack(stack_name, boto3_session) is None
+
+    if configs[pedl_config.AGENT_FAST_SNAPSHOT_RESTORE] and not configs[pedl_config.PLAN]:
+        from pedl_deploy.snapshots import enable_fast_snapshot_restore
+
+        # Started ahead of the stack, since the snapshots take a while to be optimized
+        enable_fast_snapshot_restore(configs[pedl_config.AGENT_AMI],
+                                     deployment_object.agent_availability_zones(boto3_session), boto3_session)
+    result.pending = deployment_object.deploy()
+    master_volume = configs[pedl_config.MASTER_VOLUME]
+    throughput = master_volume[volumes.THROUGHPUT] if master_volume else None
+    if result.pending:
+        result.pending['deployment_type'] = deployment_type
+        if throughput is not None:
+            print('The master volume throughput is only set by a deploy that waits for the stack')
+        return result
+    if configs[pedl_config.PLAN]:
+        result.plan = True
+        return result
+
+    with phase(boto3_session.region_name, stack_name, 'output lookup'):
+        result.outputs = get_output(stack_name, boto3_session)
+        result.addresses = deployment_object.addresses(stack_name, boto3_session)
+    result.endpoint = deployment_object.ui_endpoint(result.addresses)
+    if throughput is not None:
+        from pedl_deploy.volumes import set_master_throughput
+
+        set_master_throughput(get_ec2_info(result.outputs[cloudformation.MASTER_ID], boto3_session), throughput,
+                              boto3_session)
+    if configs[pedl_config.WAIT_READY]:
+        ready_seconds = wait_ready(deployment_object, stack_name, result.region, result.addresses, start)
+        if created:
+            result.ready_seconds = ready_seconds
+    result.timings = stack_timings(stack_name, boto3_session.region_name)
+    return result
+
+
+def delete_stack(user, boto3_session, wait=True, usage=None):
+    # Terminates the agents, empties the bucket and deletes the stack of the user. Stacks deleted together share
+    # one snapshots.StackUsage, so the stacks of the region are listed once for all of them.
+    from concurrent.futures import ThreadPoolExecutor
+
+    from pedl_deploy.aws import delete_stack as delete_cfn_stack
+    from pedl_deploy.aws import describe_stack, get_output
+    from pedl_deploy.bucket import empty_bucket
+    from pedl_deploy.snapshots import StackUsage, disable_fast_snapshot_restore
+    from pedl_deploy.status import stack_parameters
+    from pedl_deploy.teardown import drain_agents, terminate_agents
+    from pedl_deploy.timings import phase
+
+    stack_name = defaults.PEDL_STACK_NAME_BASE.format(user)
+    bucket_name = get_output(stack_name, boto3_session).get(cloudformation.CHECKPOINT_BUCKET)
+    stack = describe_stack(stack_name, boto3_session)
+    agent_ami = stack_parameters(stack).get(cloudformation.AGENT_AMI_KEY) if stack else None
+    usage = usage or StackUsage([stack_name], boto3_session)
+
+    def timed(name, function, *args):
+        with phase(boto3_session.region_name, stack_name, name):
+            return function(*args)
+
+    # The bucket is emptied while the agents are terminated. The stack delete starts as soon as both are
+    # done, and waiting for the agents to go away overlaps with the stack delete, so the teardown takes as
+    # long as its slowest step. CloudFormation only deletes the agent security group and instance profile
+    # after the master instance, by which time the agents are gone.
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        emptied = executor.submit(timed, 'empty bucket', empty_bucket, bucket_name, boto3_session) \
+            if bucket_name else None
+        restores = executor.submit(timed, 'snapshot restore', disable_fast_snapshot_restore, agent_ami, usage,
+                                   boto3_session) if agent_ami else None
+        timed('terminate agents', terminate_agents, user, boto3_session)
+        if emptied:
+            emptied.result()
+
+        stop = threading.Event()
+        drained = executor.submit(timed, 'drain agents', drain_agents, user, boto3_session, stop) if wait else None
+        try:
+            pending = delete_cfn_stack(stack_name, boto3_session, wait)
+        finally:
+            # Without the stack there is nothing left to drain, and a failed delete must not hang on the drain
+            stop.set()
+        if drained:
+            drained.result()
+        if restores:
+            restores.result()
+
+    return DeleteResult(stack_name, boto3_session.region_name, pending,
+                        stack_timings(stack_name, boto3_session.region_name))
+
+
+def wait_for_operation(state, boto3_session):
+    # Resumes waiting for an operation submitted without waiting, as recorded in the state directory
+    from pedl_deploy.clients import client
+    from pedl_deploy.events import wait_for_stack
+    from pedl_deploy.state import clear_state, save_state
+    from pedl_deploy.timings import clear as clear_timings
+    from pedl_deploy.timings import phase
+
+    def on_event(event):
+        # A later wait resumes after the last event seen here
+        state['last_event_id'] = event['EventId']
+        save_state(state)
+
+    # The timings stay for --timings of the CLI, an earlier call on the stack must not add to them
+    clear_timings(state['region'], [state['stack_name']])
+    with session_scope(boto3_session):
+        cfn = client(boto3_session, 'cloudformation')
+        try:
+            with phase(state['region'], state['stack_name'], 'wait'):
+                wait_for_stack(state['stack_name'], state['stack_id'], cfn, state['last_event_id'], on_event)
+        except StackError:
+            clear_state(state)
+            raise
+        clear_state(state)
+
+        if state['operation'] == 'delete':
+            return DeleteResult(state['stack_name'], state['region'],
+                                timings=stack_timings(state['stack_name'], state['region']))
+
+        deployment_object = deployment_class(state['deployment_type'])({})
+        addresses = deployment_object.addresses(state['stack_name'], boto3_session)
+        return DeployResult(state['stack_name'], state['region'], state['deployment_type'], addresses=addresses,
+                            endpoint=deployment_object.ui_endpoint(addresses),
+                            timings=stack_timings(state['stack_name'], state['region']))
+
+
+def status(boto3_session, users=None):
+    # The rows of --status, every pedl stack of the account without users
+    from pedl_deploy.status import collect_status, get_stacks
+
+    with session_scope(boto3_session):
+        return collect_status(get_stacks(boto3_session, users), boto3_session)
+
+
+def resolve_session(boto3_session, profile_name, region_name, client_factory):
+    if boto3_session is None:
+        return session(profile_name, region_name, client_factory)
+    if client_factory:
+        from pedl_deploy.clients import set_factory
+
+        set_factory(boto3_session, client_factory)
+    return boto3_session
+
+
+def deploy(user=None, deployment_type=defaults.DEPLOYMENT_TYPE, boto3_session=None, profile_name=None,
+           region_name=None, client_factory=None, **options):
+    # Deploys the stack of one user, the options are the flags of the CLI, e.g. max_agents=8 or spot=True
+    args = configure(deploy_options(deployment_type=deployment_type, user=user, aws_profile=profile_name, **options))
+    boto3_session = resolve_session(boto3_session, profile_name, region_name, client_factory)
+
+    with session_scope(boto3_session):
+        user = user or get_user(boto3_session)
+        with timing_scope(boto3_session.region_name, defaults.PEDL_STACK_NAME_BASE.format(user)):
+            master_ami, agent_ami, agents = preflight(args, boto3_session)
+            return deploy_stack(args.deployment_type,
+                                pedl_configs(args, user, master_ami, agent_ami, agents, boto3_session))
+
+
+def delete(user=None, boto3_session=None, profile_name=None, region_name=None, client_factory=None, wait=True):
+    boto3_session = resolve_session(boto3_session, profile_name, region_name, client_factory)
+    with session_scope(boto3_session):
+        user = user or get_user(boto3_session)
+        with timing_scope(boto3_session.region_name, defaults.PEDL_STACK_NAME_BASE.format(user)):
+            return delete_stack(user, boto3_session, wait)
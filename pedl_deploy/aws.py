@@ -1,140 +1,296 @@
-import sys
+import datetime
+import re
+import threading
+import time
+from concurrent.futures import Future
 
 import boto3
 from botocore.exceptions import ClientError, WaiterError
 
+from pedl_deploy.clients import client
+from pedl_deploy.constants import cloudformation, stack_status
+from pedl_deploy.errors import StackError, TemplateError
+from pedl_deploy.events import latest_event_id, wait_for_stack
+from pedl_deploy.templating import is_validated, mark_validated, template_hash
+from pedl_deploy.timings import phase
 
-def session(profile_name):
-    return boto3.Session(profile_name=profile_name)
+_cache_lock = threading.Lock()
+_stack_cache = {}
+_identity_cache = {}
+_validated_templates = set()
 
 
-# Cloudformation
-def stack_exists(stack_name, boto3_session):
-    cfn = boto3_session.client('cloudformation')
+def session(profile_name, region_name=None):
+    return boto3.Session(profile_name=profile_name, region_name=region_name)
+
+
+def cached(cache, key, fetch):
+    # Concurrent callers of a key wait for the request of the first one instead of sending their own. A failed
+    # request reaches the callers waiting for it but is not cached.
+    with _cache_lock:
+        future = cache.get(key)
+        fetching = future is None
+        if fetching:
+            future = cache[key] = Future()
+    if not fetching:
+        return future.result()
 
     try:
-        cfn.describe_stacks(StackName=stack_name)
-    except ClientError:
-        print(f'{stack_name} not found')
-        return False
-    return True
+        result = fetch()
+    except BaseException as e:
+        with _cache_lock:
+            if cache.get(key) is future:
+                del cache[key]
+        future.set_exception(e)
+        raise
+    future.set_result(result)
+    return result
+
 
+# STS
+def get_caller_identity(boto3_session):
+    return cached(_identity_cache, id(boto3_session), client(boto3_session, 'sts').get_caller_identity)
 
-def delete_stack(stack_name, boto3_session):
-    cfn = boto3_session.client('cloudformation')
-    delete_waiter = cfn.get_waiter('stack_delete_complete')
 
+# Cloudformation
+def is_missing_stack(error):
+    details = error.response.get('Error', {})
+    return details.get('Code') == stack_status.MISSING_ERROR_CODE and \
+        stack_status.MISSING_MESSAGE in details.get('Message', '')
+
+
+def describe_stack(stack_name, boto3_session, quiet=False):
+    def fetch():
+        cfn = client(boto3_session, 'cloudformation')
+        try:
+            return cfn.describe_stacks(StackName=stack_name)['Stacks'][0]
+        except ClientError as e:
+            # Throttling, access or credential errors say nothing about the stack, so they are not cached
+            if not is_missing_stack(e):
+                raise StackError(stack_name, f'Describing {stack_name} failed: {e}') from e
+            if not quiet:
+                print(f'{stack_name} not found')
+            return None
+
+    return cached(_stack_cache, (id(boto3_session), stack_name), fetch)
+
+
+def invalidate_stack(stack_name, boto3_session):
+    with _cache_lock:
+        _stack_cache.pop((id(boto3_session), stack_name), None)
+
+
+def forget_session(boto3_session):
+    # Another session may later get the same id
+    with _cache_lock:
+        _identity_cache.pop(id(boto3_session), None)
+        for key in [key for key in _stack_cache if key[0] == id(boto3_session)]:
+            del _stack_cache[key]
+
+
+def pending_operation(stack_name, stack_id, operation, last_event_id, boto3_session):
+    # Everything a later run needs to resume waiting for a submitted operation
+    return {
+        'stack_name': stack_name,
+        'stack_id': stack_id,
+        'operation': operation,
+        'region': boto3_session.region_name,
+        'started': time.time(),
+        'last_event_id': last_event_id
+    }
+
+
+def delete_stack(stack_name, boto3_session, wait=True):
+    cfn = client(boto3_session, 'cloudformation')
+    stack = describe_stack(stack_name, boto3_session)
+    if stack is None:
+        return None
+
+    # Deleted stacks can only be described by their id
+    stack_id = stack['StackId']
     print(f'Deleting stack {stack_name}')
-    cfn.delete_stack(StackName=stack_name)
-    try:
-        delete_waiter.wait(StackName=stack_name,
-                           WaiterConfig={
-                               'Delay': 10
-                           })
-    except WaiterError as e:
-        print(e)
-        sys.exit(1)
+    with phase(boto3_session.region_name, stack_name, 'submit'):
+        last_event_id = latest_event_id(stack_id, cfn)
+        cfn.delete_stack(StackName=stack_id)
+    invalidate_stack(stack_name, boto3_session)
+    if not wait:
+        return pending_operation(stack_name, stack_id, 'delete', last_event_id, boto3_session)
+
+    with phase(boto3_session.region_name, stack_name, 'wait'):
+        wait_for_stack(stack_name, stack_id, cfn, last_event_id)
+    return None
+
+
+def stack_kwargs(stack_name, template_body, parameters=None, tags=None):
+    kwargs = {
+        'StackName': stack_name,
+        'TemplateBody': template_body,
+        'Capabilities': [
+            'CAPABILITY_IAM',
+        ],
+    }
+    if parameters:
+        kwargs['Parameters'] = parameters
+    if tags:
+        kwargs['Tags'] = tags
+    return kwargs
 
 
-def update_stack(stack_name, template_body, boto3_session, parameters=None):
+def update_stack(stack_name, template_body, boto3_session, parameters=None, tags=None, wait=True):
     print(f'Updating stack {stack_name}')
-    cfn = boto3_session.client('cloudformation')
-    update_waiter = cfn.get_waiter('stack_update_complete')
+    cfn = client(boto3_session, 'cloudformation')
 
     try:
-        if parameters:
-            cfn.update_stack(
-                StackName=stack_name,
-                TemplateBody=template_body,
-                Parameters=parameters,
-                Capabilities=[
-                    'CAPABILITY_IAM',
-                ],
-            )
-        else:
-            cfn.update_stack(
-                StackName=stack_name,
-                TemplateBody=template_body,
-                Capabilities=[
-                    'CAPABILITY_IAM',
-                ]
-            )
+        with phase(boto3_session.region_name, stack_name, 'submit'):
+            last_event_id = latest_event_id(stack_name, cfn)
+            response = cfn.update_stack(**stack_kwargs(stack_name, template_body, parameters, tags))
     except ClientError as e:
         if not str(e).endswith('No updates are to be performed.'):
-            print(e)
-            sys.exit(1)
-        else:
-            print(f'No Updates to {stack_name}')
-            return
+            raise StackError(stack_name, str(e)) from e
+        print(f'No Updates to {stack_name}')
+        return None
 
-    try:
-        update_waiter.wait(StackName=stack_name,
-                           WaiterConfig={
-                               'Delay': 10
-                           })
+    invalidate_stack(stack_name, boto3_session)
+    if not wait:
+        return pending_operation(stack_name, response['StackId'], 'update', last_event_id, boto3_session)
 
-    except WaiterError as e:
-        print(e)
-        sys.exit(1)
+    with phase(boto3_session.region_name, stack_name, 'wait'):
+        wait_for_stack(stack_name, response['StackId'], cfn, last_event_id)
+    return None
 
 
-def create_stack(stack_name, template_body, boto3_session, parameters=None):
+def create_stack(stack_name, template_body, boto3_session, parameters=None, tags=None, wait=True):
     print(f'Creating stack {stack_name}')
-    cfn = boto3_session.client('cloudformation')
-    create_waiter = cfn.get_waiter('stack_create_complete')
+    cfn = client(boto3_session, 'cloudformation')
 
-    if parameters:
-        cfn.create_stack(
-            StackName=stack_name,
-            TemplateBody=template_body,
-            Parameters=parameters,
-            Capabilities=[
-                'CAPABILITY_IAM',
-            ],
-        )
-    else:
-        cfn.create_stack(
-            StackName=stack_name,
-            TemplateBody=template_body,
-            Capabilities=[
-                'CAPABILITY_IAM',
-            ]
-        )
-    try:
-        create_waiter.wait(StackName=stack_name,
-                           WaiterConfig={
-                               'Delay': 10
-                           })
+    with phase(boto3_session.region_name, stack_name, 'submit'):
+        response = cfn.create_stack(**stack_kwargs(stack_name, template_body, parameters, tags))
+    invalidate_stack(stack_name, boto3_session)
+    if not wait:
+        return pending_operation(stack_name, response['StackId'], 'create', None, boto3_session)
 
-    except WaiterError as e:
-        print(e)
-        sys.exit(1)
+    with phase(boto3_session.region_name, stack_name, 'wait'):
+        wait_for_stack(stack_name, response['StackId'], cfn)
+    return None
 
 
 def get_output(stack_name, boto3_session):
-    cfn = boto3_session.client('cloudformation')
-    response = cfn.describe_stacks(StackName=stack_name)
+    stack = describe_stack(stack_name, boto3_session)
     response_dict = {}
+    if stack is None:
+        return response_dict
 
-    for output in response['Stacks'][0]['Outputs']:
+    for output in stack.get('Outputs', []):
         k, v = output['OutputKey'], output['OutputValue']
         response_dict[k] = v
     return response_dict
 
 
-def deploy_stack(stack_name, template_body, boto3_session, parameters=None):
-    cfn = boto3_session.client('cloudformation')
-    cfn.validate_template(TemplateBody=template_body)
+def validate_template(template_body, boto3_session):
+    # A template is only sent for validation once, the hashes of validated templates are kept on disk
+    digest = template_hash(template_body)
+    with _cache_lock:
+        if digest in _validated_templates:
+            return
+    if is_validated(digest):
+        with _cache_lock:
+            _validated_templates.add(digest)
+        return
+
+    client(boto3_session, 'cloudformation').validate_template(TemplateBody=template_body)
+    mark_validated(digest)
+    with _cache_lock:
+        _validated_templates.add(digest)
+
+
+def with_hash_output(template_body):
+    # The templates end with their Outputs, so the hash of the template is added as the last output
+    sections = re.findall(r'^([A-Za-z]+):', template_body, re.MULTILINE)
+    if not sections or sections[-1] != 'Outputs':
+        raise TemplateError('The template must end with its Outputs to record its hash')
+    return f'{template_body.rstrip()}\n\n  {cloudformation.TEMPLATE_HASH_OUTPUT}:\n' \
+           f'    Value: {template_hash(template_body)}\n'
+
+
+def is_up_to_date(stack, template_body, parameters=None):
+    if stack['StackStatus'] not in stack_status.STABLE_STATUSES:
+        return False
+
+    outputs = {output['OutputKey']: output['OutputValue'] for output in stack.get('Outputs', [])}
+    if outputs.get(cloudformation.TEMPLATE_HASH_OUTPUT) != template_hash(template_body):
+        return False
+
+    current = {p['ParameterKey']: p.get('ParameterValue') for p in stack.get('Parameters', [])}
+    return all(current.get(p['ParameterKey']) == p['ParameterValue'] for p in parameters or [])
+
+
+def plan_stack(stack_name, template_body, boto3_session, parameters=None, exists=True):
+    cfn = client(boto3_session, 'cloudformation')
+    change_set_type = 'UPDATE' if exists else 'CREATE'
 
-    if stack_exists(stack_name, boto3_session):
-        update_stack(stack_name, template_body, boto3_session, parameters)
+    kwargs = stack_kwargs(stack_name, template_body, parameters)
+    response = cfn.create_change_set(ChangeSetName=f'{stack_name}-plan-{int(time.time())}',
+                                     ChangeSetType=change_set_type, **kwargs)
+    change_set_id = response['Id']
+
+    try:
+        cfn.get_waiter('change_set_create_complete').wait(ChangeSetName=change_set_id,
+                                                          WaiterConfig={
+                                                              'Delay': 2
+                                                          })
+    except WaiterError:
+        pass
+
+    change_set = cfn.describe_change_set(ChangeSetName=change_set_id)
+    changes = change_set.get('Changes', [])
+    while 'NextToken' in change_set:
+        change_set = cfn.describe_change_set(ChangeSetName=change_set_id, NextToken=change_set['NextToken'])
+        changes.extend(change_set.get('Changes', []))
+
+    if change_set['Status'] == 'FAILED' and not changes:
+        print(f'Plan for {stack_name}: {change_set.get("StatusReason", "no changes")}')
     else:
-        create_stack(stack_name, template_body, boto3_session, parameters)
+        print(f'Plan for {stack_name}:')
+        for change in changes:
+            resource = change['ResourceChange']
+            line = f'  {resource["Action"]:<8} {resource["LogicalResourceId"]} ({resource["ResourceType"]})'
+            if resource.get('Replacement') in ('True', 'Conditional'):
+                line += f' replacement: {resource["Replacement"]}'
+            print(line)
+
+    cfn.delete_change_set(ChangeSetName=change_set_id)
+    if not exists:
+        # A CREATE change set leaves an empty stack in REVIEW_IN_PROGRESS behind
+        cfn.delete_stack(StackName=stack_name)
+        invalidate_stack(stack_name, boto3_session)
+
+
+def deploy_stack(stack_name, template_body, boto3_session, parameters=None, plan=False, wait=True):
+    # Returns the pending operation when not waiting for it, None once the stack is deployed
+    stack = describe_stack(stack_name, boto3_session)
+
+    # Skip validation and the update round trips when the stack already runs this template
+    if stack and is_up_to_date(stack, template_body, parameters):
+        print(f'No Updates to {stack_name}')
+        return None
+
+    # The template as the preflight check validated it, the hash output does not change whether it is valid
+    with phase(boto3_session.region_name, stack_name, 'validate'):
+        validate_template(template_body, boto3_session)
+    template_body = with_hash_output(template_body)
+
+    if plan:
+        plan_stack(stack_name, template_body, boto3_session, parameters, exists=stack is not None)
+        return None
+
+    if stack:
+        return update_stack(stack_name, template_body, boto3_session, parameters, wait=wait)
+    return create_stack(stack_name, template_body, boto3_session, parameters, wait=wait)
 
 
 # EC2
 def get_ec2_info(instance_id, boto3_session):
-    ec2 = boto3_session.client('ec2')
+    ec2 = client(boto3_session, 'ec2')
 
     response = ec2.describe_instances(
         InstanceIds=[
@@ -144,60 +300,95 @@ def get_ec2_info(instance_id, boto3_session):
     return response['Reservations'][0]['Instances'][0]
 
 
-def get_latest_release_amis(boto3_session):
-    ec2 = boto3_session.client('ec2')
+def describe_instances(filters, boto3_session):
+    # Filters do not fail on unknown ids, unlike InstanceIds, so one lookup can cover many stacks
+    paginator = client(boto3_session, 'ec2').get_paginator('describe_instances')
+    instances = []
+    for page in paginator.paginate(Filters=filters):
+        for reservation in page['Reservations']:
+            instances.extend(reservation['Instances'])
+    return instances
+
 
-    response = ec2.describe_images(
+def availability_zones(boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+    zones = ec2.describe_availability_zones(
         Filters=[
             {
-                'Name': 'tag:image_type',
-                'Values': [
-                    'release',
-                ]
-            },
-        ],
+                'Name': 'state',
+                'Values': ['available']
+            }
+        ]
+    )['AvailabilityZones']
+    # Sorted like Fn::GetAZs, which the templates use to place the subnets
+    return sorted(zone['ZoneName'] for zone in zones)
 
-        Owners=['self']
-    )
 
-    images = sorted(response['Images'], key=lambda x: x['CreationDate'], reverse=True)
-    agent_image, master_image = None, None
-    agent_version, master_version = None, None
-    for image in images:
-        if 'agent' in image['Name']:
-            agent_image = image['ImageId']
-            for tag in image['Tags']:
-                if tag['Key'] == 'pedl-version':
-                    agent_version = tag['Value']
-            break
+def default_subnets(boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+    subnets = ec2.describe_subnets(
+        Filters=[
+            {
+                'Name': 'default-for-az',
+                'Values': ['true']
+            }
+        ]
+    )['Subnets']
+    return {subnet['AvailabilityZone']: subnet['SubnetId'] for subnet in subnets}
+
 
-    for image in images:
-        if 'master' in image['Name']:
-            master_image = image['ImageId']
-            for tag in image['Tags']:
-                if tag['Key'] == 'pedl-version':
-                    master_version = tag['Value']
-            break
+def default_subnet_zones(boto3_session):
+    return sorted(default_subnets(boto3_session))
 
-    assert master_version == agent_version
-    return master_image, agent_image
 
+def instance_type_zones(instance_types, boto3_session):
+    # Maps each offered instance type to the zones it is offered in, a type offered in the region may still be
+    # missing from the zone the agents launch in
+    paginator = client(boto3_session, 'ec2').get_paginator('describe_instance_type_offerings')
+    zones = {}
+    for page in paginator.paginate(
+            LocationType='availability-zone',
+            Filters=[
+                {
+                    'Name': 'instance-type',
+                    'Values': instance_types
+                }
+            ]):
+        for offering in page['InstanceTypeOfferings']:
+            zones.setdefault(offering['InstanceType'], set()).add(offering['Location'])
+    return zones
 
-def check_keypair(name, boto3_session):
-    ec2 = boto3_session.client('ec2')
 
-    all_keys = ec2.describe_key_pairs()['KeyPairs']
-    names = [x['KeyName'] for x in all_keys]
+def describe_instance_type(instance_type, boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+    return ec2.describe_instance_types(InstanceTypes=[instance_type])['InstanceTypes'][0]
 
-    if name in names:
-        return True
 
-    print(f'Key pair {name} not found. Please create key pair first')
-    sys.exit(1)
+def image_ena_support(image_id, boto3_session):
+    # None when EC2 does not say, e.g. for images registered before the attribute existed
+    ec2 = client(boto3_session, 'ec2')
+    images = ec2.describe_images(ImageIds=[image_id])['Images']
+    return images[0].get('EnaSupport') if images else None
 
 
-# S3
-def empty_bucket(bucket_name, boto3_session):
-    s3 = boto3_session.resource('s3')
-    bucket = s3.Bucket(bucket_name)
-    bucket.objects.all().delete()
\ No newline at end of file
+def has_spot_price(instance_type, product_description, boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+    prices = ec2.describe_spot_price_history(
+        InstanceTypes=[instance_type],
+        ProductDescriptions=[product_description],
+        StartTime=datetime.datetime.now(datetime.timezone.utc),
+        MaxResults=1
+    )['SpotPriceHistory']
+    return bool(prices)
+
+
+def keypair_exists(name, boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+
+    try:
+        ec2.describe_key_pairs(KeyNames=[name])
+    except ClientError as e:
+        if e.response['Error']['Code'] == 'InvalidKeyPair.NotFound':
+            return False
+        raise
+    return True
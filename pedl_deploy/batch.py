@@ -0,0 +1,48 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from pedl_deploy.errors import PEDLDeployError
+
+
+def read_users(users, users_file):
+    names = []
+    if users:
+        names.extend(users.split(','))
+
+    if users_file:
+        with open(users_file) as f:
+            for line in f:
+                names.append(line.split('#', 1)[0])
+
+    names = [name.strip() for name in names if name.strip()]
+    return list(dict.fromkeys(names))
+
+
+def run_batch(users, task, max_workers):
+    results = {}
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(task, user): user for user in users}
+        for future in as_completed(futures):
+            user = futures[future]
+            try:
+                future.result()
+                results[user] = None
+            except PEDLDeployError as e:
+                results[user] = str(e)
+            except Exception as e:
+                results[user] = f'{type(e).__name__}: {e}'
+
+    return {user: results[user] for user in users}
+
+
+def print_summary(results, stack_name_base):
+    print()
+    print('Batch Summary')
+    for user, error in results.items():
+        stack_name = stack_name_base.format(user)
+        if error is None:
+            print(f'  {stack_name}: succeeded')
+        else:
+            print(f'  {stack_name}: FAILED ({error})')
+
+    succeeded = sum(1 for error in results.values() if error is None)
+    print(f'{succeeded}/{len(results)} stacks succeeded')
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from pedl_deploy.clients import client
+from pedl_deploy.constants import bucket_deletion
+from pedl_deploy.errors import BucketError
+
+
+class BucketEmptier:
+    def __init__(self, bucket_name, boto3_session, max_workers=bucket_deletion.MAX_WORKERS):
+        self._bucket_name = bucket_name
+        self._max_workers = max_workers
+        self._s3 = client(boto3_session, 's3')
+        self._lock = threading.Lock()
+        self._delete_pool = None
+        self._delete_futures = []
+        self.objects = 0
+        self.bytes = 0
+        self.uploads = 0
+        self.errors = []
+
+    def empty(self):
+        start = time.time()
+        list_pool = ThreadPoolExecutor(max_workers=self._max_workers)
+        self._delete_pool = ThreadPoolExecutor(max_workers=self._max_workers)
+        try:
+            prefixes = self._list_root()
+            for future in [list_pool.submit(self._list_prefix, prefix) for prefix in prefixes]:
+                future.result()
+            self._abort_uploads()
+
+            for future in self._delete_futures:
+                future.result()
+        finally:
+            list_pool.shutdown()
+            self._delete_pool.shutdown()
+
+        elapsed = max(time.time() - start, 1e-3)
+        print(f'Emptied {self._bucket_name}: {self.objects} objects, {self.bytes / 2 ** 20:.1f} MiB freed, '
+              f'{self.uploads} multipart uploads aborted in {elapsed:.1f}s ({self.objects / elapsed:.0f} objects/s)')
+        for error in self.errors[:bucket_deletion.MAX_REPORTED_ERRORS]:
+            print(f'Failed to delete {error["Key"]}: {error["Message"]}')
+        # The stack delete would only fail on the bucket much later, without the reason
+        if self.errors:
+            raise BucketError(f'{len(self.errors)} object versions of {self._bucket_name} could not be deleted')
+
+    def _list_root(self):
+        # Listing with a delimiter returns the top level prefixes, which are then listed in parallel.
+        # Versions stored directly under the bucket root are deleted from here.
+        prefixes = []
+        paginator = self._s3.get_paginator('list_object_versions')
+        for page in paginator.paginate(Bucket=self._bucket_name, Delimiter='/'):
+            prefixes.extend(prefix['Prefix'] for prefix in page.get('CommonPrefixes', []))
+            self._delete_page(page)
+        return prefixes
+
+    def _list_prefix(self, prefix):
+        paginator = self._s3.get_paginator('list_object_versions')
+        for page in paginator.paginate(Bucket=self._bucket_name, Prefix=prefix):
+            self._delete_page(page)
+
+    def _delete_page(self, page):
+        # Delete markers have no size
+        versions = page.get('Versions', []) + page.get('DeleteMarkers', [])
+        for i in range(0, len(versions), bucket_deletion.BATCH_SIZE):
+            batch = versions[i:i + bucket_deletion.BATCH_SIZE]
+            with self._lock:
+                self._delete_futures.append(self._delete_pool.submit(self._delete_batch, batch))
+
+    def _delete_batch(self, versions):
+        errors = []
+        for attempt in range(bucket_deletion.MAX_ATTEMPTS):
+            if attempt:
+                time.sleep(bucket_deletion.RETRY_DELAY * 2 ** (attempt - 1))
+            keys = [{'Key': version['Key'], 'VersionId': version['VersionId']} for version in versions]
+            response = self._s3.delete_objects(Bucket=self._bucket_name, Delete={'Objects': keys, 'Quiet': True})
+
+            # Only the failed versions of a key are kept, its other versions are gone
+            errors = response.get('Errors', [])
+            failed = {(error['Key'], error.get('VersionId')) for error in errors}
+            deleted = [version for version in versions if (version['Key'], version['VersionId']) not in failed]
+            with self._lock:
+                self.objects += len(deleted)
+                self.bytes += sum(version.get('Size', 0) for version in deleted)
+            versions = [version for version in versions if (version['Key'], version['VersionId']) in failed]
+            if not versions:
+                return
+
+        with self._lock:
+            self.errors.extend(errors)
+
+    def _abort_uploads(self):
+        paginator = self._s3.get_paginator('list_multipart_uploads')
+        for page in paginator.paginate(Bucket=self._bucket_name):
+            for upload in page.get('Uploads', []):
+                self._s3.abort_multipart_upload(Bucket=self._bucket_name, Key=upload['Key'],
+                                                UploadId=upload['UploadId'])
+                with self._lock:
+                    self.uploads += 1
+
+
+def empty_bucket(bucket_name, boto3_session):
+    try:
+        BucketEmptier(bucket_name, boto3_session).empty()
+    except ClientError as e:
+        if e.response['Error']['Code'] != 'NoSuchBucket':
+            raise
+        print(f'Bucket {bucket_name} not found')
@@ -0,0 +1,60 @@
+import threading
+
+from botocore.config import Config
+
+from pedl_deploy.constants import client_config
+
+_lock = threading.Lock()
+_clients = {}
+_factories = {}
+_handlers = []
+
+_config = Config(
+    max_pool_connections=client_config.MAX_POOL_CONNECTIONS,
+    retries={
+        'mode': client_config.RETRY_MODE,
+        'max_attempts': client_config.MAX_ATTEMPTS
+    }
+)
+
+
+def client(boto3_session, service_name, region_name=None):
+    # Creating clients from a shared session is not thread safe, the clients themselves are.
+    # The session is kept in the registry so its id can not be reused by another session.
+    region_name = region_name or boto3_session.region_name
+    key = (id(boto3_session), service_name, region_name)
+    with _lock:
+        if key not in _clients:
+            factory = _factories.get(id(boto3_session))
+            if factory:
+                new_client = factory[1](boto3_session, service_name, region_name)
+            else:
+                new_client = boto3_session.client(service_name, region_name=region_name, config=_config)
+            for event_name, handler in _handlers:
+                new_client.meta.events.register(event_name, handler)
+            _clients[key] = (boto3_session, new_client)
+        return _clients[key][1]
+
+
+def set_factory(boto3_session, factory):
+    # The clients of the session come from factory(boto3_session, service_name, region_name) instead, e.g. to
+    # share clients and their connection pools with the rest of a long running process
+    with _lock:
+        _factories[id(boto3_session)] = (boto3_session, factory)
+        for key in [key for key in _clients if key[0] == id(boto3_session)]:
+            del _clients[key]
+
+
+def register_handler(event_name, handler):
+    # Botocore event handlers are attached to every client of the registry, including the ones created later
+    with _lock:
+        _handlers.append((event_name, handler))
+        for _, registered in _clients.values():
+            registered.meta.events.register(event_name, handler)
+
+
+def clear(boto3_session=None):
+    # Drops the clients of the session, or of every session, the factories stay registered
+    with _lock:
+        for key in [key for key in _clients if boto3_session is None or key[0] == id(boto3_session)]:
+            del _clients[key]
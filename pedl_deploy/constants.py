@@ -11,6 +11,7 @@ class defaults:
     BASTION_AMI = 'ami-06d51e91cea0dac8d'
     DEPLOYMENT_TYPE = deployment_types.SIMPLE
     PEDL_STACK_NAME_BASE = "pedl-{}"
+    MAX_WORKERS = 8
 
 class pedl_config:
     MASTER_AMI = 'master_ami'
@@ -21,6 +22,26 @@ class pedl_config:
     PEDL_STACK_NAME = 'stack_name'
     USER = 'user'
     BOTO3_SESSION = 'boto3_session'
+    PLAN = 'plan'
+    WAIT = 'wait'
+    WAIT_READY = 'wait_ready'
+    MIN_AGENT_INSTANCES = 'min_agent_instances'
+    MAX_AGENT_INSTANCES = 'max_agent_instances'
+    MAX_IDLE_AGENT_PERIOD = 'max_idle_agent_period'
+    MASTER_VOLUME = 'master_volume'
+    AGENT_VOLUME = 'agent_volume'
+    AGENT_SPOT = 'agent_spot'
+    AGENT_FAST_SNAPSHOT_RESTORE = 'agent_fast_snapshot_restore'
+    AGENT_PLACEMENT_GROUP = 'agent_placement_group'
+    SAVE_EXPERIMENT_BEST = 'save_experiment_best'
+    SAVE_TRIAL_BEST = 'save_trial_best'
+    SAVE_TRIAL_LATEST = 'save_trial_latest'
+    CHECKPOINT_EXPIRATION_DAYS = 'checkpoint_expiration_days'
+    ABORT_MULTIPART_UPLOAD_DAYS = 'abort_multipart_upload_days'
+    DATABASE_INSTANCE_CLASS = 'database_instance_class'
+    DATABASE_MIN_CAPACITY = 'database_min_capacity'
+    DATABASE_MAX_CAPACITY = 'database_max_capacity'
+    DATABASE_AUTO_PAUSE = 'database_auto_pause'
 
 
 class cloudformation:
@@ -43,12 +64,205 @@ class cloudformation:
     PRIVATE_IP_ADDRESS = 'PrivateIpAddress'
     SUBNET_ID_KEY = 'SubnetId'
     PEDLIP = 'PEDLIP'
+    # An output rather than a stack tag, CloudFormation copies stack tags onto every resource and re-tags them all
+    # whenever a tag changes
+    TEMPLATE_HASH_OUTPUT = 'TemplateHash'
+    NETWORK_STACK_NAME_KEY = 'NetworkStackName'
+    MIN_AGENT_INSTANCES_KEY = 'MinAgentInstances'
+    MAX_AGENT_INSTANCES_KEY = 'MaxAgentInstances'
+    MAX_IDLE_AGENT_PERIOD_KEY = 'MaxIdleAgentPeriod'
+    AGENT_ROOT_VOLUME_SIZE_KEY = 'AgentRootVolumeSize'
+    AGENT_ROOT_VOLUME_TYPE_KEY = 'AgentRootVolumeType'
+    AGENT_ROOT_VOLUME_IOPS_KEY = 'AgentRootVolumeIops'
+    AGENT_ROOT_VOLUME_THROUGHPUT_KEY = 'AgentRootVolumeThroughput'
+    MASTER_VOLUME_SIZE_KEY = 'MasterVolumeSize'
+    MASTER_VOLUME_TYPE_KEY = 'MasterVolumeType'
+    MASTER_VOLUME_IOPS_KEY = 'MasterVolumeIops'
+    SAVE_EXPERIMENT_BEST_KEY = 'SaveExperimentBest'
+    SAVE_TRIAL_BEST_KEY = 'SaveTrialBest'
+    SAVE_TRIAL_LATEST_KEY = 'SaveTrialLatest'
+    CHECKPOINT_EXPIRATION_DAYS_KEY = 'CheckpointExpirationDays'
+    ABORT_MULTIPART_UPLOAD_DAYS_KEY = 'AbortMultipartUploadDays'
+    AGENT_SPOT_KEY = 'AgentSpotInstances'
+    AGENT_PLACEMENT_GROUP_KEY = 'AgentClusterPlacement'
+    AGENT_SUBNET_KEY = 'AgentSubnet'
+    WAIT_FOR_MASTER_KEY = 'WaitForMaster'
+    DATABASE_INSTANCE_CLASS_KEY = 'DatabaseInstanceClass'
+    DATABASE_MIN_CAPACITY_KEY = 'DatabaseMinCapacity'
+    DATABASE_MAX_CAPACITY_KEY = 'DatabaseMaxCapacity'
+    DATABASE_AUTO_PAUSE_KEY = 'DatabaseAutoPause'
+    DATABASE_SECONDS_UNTIL_AUTO_PAUSE_KEY = 'DatabaseSecondsUntilAutoPause'
+
+
+class stack_status:
+    STABLE_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE']
+    # A rolled back update leaves the previous resources in place, the stack can be used and updated again
+    USABLE_STATUSES = STABLE_STATUSES + ['UPDATE_ROLLBACK_COMPLETE']
+    # describe_stacks answers a missing stack with this error code and message
+    MISSING_ERROR_CODE = 'ValidationError'
+    MISSING_MESSAGE = 'does not exist'
+
+
+class stack_events:
+    STACK_RESOURCE_TYPE = 'AWS::CloudFormation::Stack'
+    # The update is done once cleanup of replaced resources starts
+    SUCCESS_STATUSES = ['CREATE_COMPLETE', 'UPDATE_COMPLETE', 'UPDATE_COMPLETE_CLEANUP_IN_PROGRESS', 'DELETE_COMPLETE']
+    MIN_POLL_DELAY = 2
+    MAX_POLL_DELAY = 15
+    POLL_BACKOFF = 1.5
+    FAST_POLL_PERIOD = 30
+    # The boto3 waiters gave up after an hour, deletes held up by network interfaces can take longer
+    TIMEOUT = 2 * 60 * 60
+
+
+class readiness:
+    # Polls of the master UI back off up to MAX_DELAY, for at most TIMEOUT seconds in total
+    MIN_DELAY = 2
+    MAX_DELAY = 30
+    BACKOFF = 2
+    TIMEOUT = 15 * 60
+    REQUEST_TIMEOUT = 5
+
+
+class ami_catalog:
+    ROLES = ['master', 'agent']
+    VERSION_TAG = 'pedl-version'
+    CACHE_TTL = 60 * 60
+
+
+class preflight:
+    MAX_WORKERS = 8
+    NAME_WIDTH = 16
+    BLOCKED_STACK_STATUSES = ['ROLLBACK_COMPLETE', 'ROLLBACK_FAILED', 'DELETE_FAILED', 'UPDATE_ROLLBACK_FAILED']
+
+
+class ami_replication:
+    SOURCE_TAG = 'pedl-source-ami'
+    POLL_DELAY = 15
+
+
+class timing:
+    RUN_SCOPE = 'run'
+    # Seconds between a resource finishing and the next one starting that still count as a dependency
+    CRITICAL_PATH_TOLERANCE = 2
+
+
+class client_config:
+    # Enough connections for the batch and bucket deletion thread pools
+    MAX_POOL_CONNECTIONS = 50
+    # Adaptive retries add a client side token bucket that slows down on throttling. Clients are shared
+    # through the registry, so all threads calling a service in a region share one rate.
+    RETRY_MODE = 'adaptive'
+    MAX_ATTEMPTS = 10
+
+class api_stats:
+    THROTTLE_ERROR_CODES = [
+        'Throttling',
+        'ThrottlingException',
+        'ThrottledException',
+        'RequestThrottledException',
+        'TooManyRequestsException',
+        'RequestLimitExceeded',
+        'SlowDown'
+    ]
+    OPERATION_WIDTH = 40
+
+
+class checkpoint_storage:
+    # The retention the templates always used
+    DEFAULT_SAVE_EXPERIMENT_BEST = 0
+    DEFAULT_SAVE_TRIAL_BEST = 1
+    DEFAULT_SAVE_TRIAL_LATEST = 1
+    # 0 turns the lifecycle rule off
+    DEFAULT_EXPIRATION_DAYS = 0
+    DEFAULT_ABORT_MULTIPART_UPLOAD_DAYS = 7
+
+
+class database:
+    # The Aurora Serverless v1 capacity units for PostgreSQL
+    CAPACITY_UNITS = [2, 4, 8, 16, 32, 64, 192, 384]
+    # The AWS defaults the templates always used
+    DEFAULT_MIN_CAPACITY = 2
+    DEFAULT_MAX_CAPACITY = 16
+    DEFAULT_AUTO_PAUSE = 300
+    AUTO_PAUSE_LIMITS = (300, 86400)
+    INSTANCE_CLASS_PREFIX = 'db.'
+
+
+class templating:
+    COMPONENTS_KEY = 'Components'
+    VARIABLES_KEY = 'Variables'
+    COMPONENT_PATH = 'components/{}.yaml'
+    # The order of the sections in a rendered template
+    SECTIONS = ['AWSTemplateFormatVersion', 'Description', 'Metadata', 'Parameters', 'Mappings', 'Conditions',
+                'Resources', 'Outputs']
+    # The sections components contribute entries to
+    MERGED_SECTIONS = ['Parameters', 'Mappings', 'Conditions', 'Resources', 'Outputs']
+    PSEUDO_PARAMETERS = ['AWS::AccountId', 'AWS::NotificationARNs', 'AWS::NoValue', 'AWS::Partition', 'AWS::Region',
+                         'AWS::StackId', 'AWS::StackName', 'AWS::URLSuffix']
+    VALIDATED_DIR = 'validated-templates'
+
+
+class bucket_deletion:
+    MAX_WORKERS = 16
+    # Upper limit of keys in a single delete_objects call
+    BATCH_SIZE = 1000
+    MAX_REPORTED_ERRORS = 10
+    # Keys that fail to delete, e.g. on SlowDown or InternalError, are retried with a backoff
+    MAX_ATTEMPTS = 4
+    RETRY_DELAY = 1
 
 
 class resources:
     SIMPLE = 'simple.yaml'
     SECURE = 'secure.yaml'
     VPC = 'vpc.yaml'
+    SHARED_SECURE = 'secure-shared.yaml'
+    SHARED_VPC = 'vpc-shared.yaml'
+    NETWORK = 'network.yaml'
+
+class fleet_status:
+    # EC2 accepts at most 200 values per filter
+    MAX_FILTER_VALUES = 200
+    AGENT_TAG_KEY = 'pedl-{}'
+    AGENT_STATES = ['pending', 'running']
+    # Stacks of explicit users are described concurrently
+    MAX_WORKERS = 8
+
+class network:
+    STACK_NAME = 'pedl-shared-network'
+
+class volumes:
+    SIZE = 'size'
+    TYPE = 'type'
+    IOPS = 'iops'
+    THROUGHPUT = 'throughput'
+    KEYS = [SIZE, TYPE, IOPS, THROUGHPUT]
+    TYPES = ['gp2', 'gp3', 'io1', 'io2']
+    DEFAULT_SIZE = 200
+    DEFAULT_TYPE = 'gp3'
+    # The gp3 baseline, included in its price
+    DEFAULT_IOPS = 3000
+    DEFAULT_THROUGHPUT = 125
+    IOPS_LIMITS = {'gp3': (3000, 16000), 'io1': (100, 64000), 'io2': (100, 64000)}
+    THROUGHPUT_LIMITS = {'gp3': (125, 1000)}
+    # gp3 allows at most 0.25 MiB/s of throughput per provisioned IOPS
+    MAX_THROUGHPUT_PER_IOPS = 0.25
+    # Masters deployed before the volume settings, changing their volume replaces the instance
+    LEGACY_MASTER_VOLUME = {SIZE: 200, TYPE: 'gp2', IOPS: None, THROUGHPUT: None}
+
+class fast_snapshot_restore:
+    ACTIVE_STATES = ['enabling', 'optimizing', 'enabled']
+
+class teardown:
+    AGENT_TAG_VALUE = 'pedl-{}-agent'
+    LIVE_STATES = ['pending', 'running', 'shutting-down', 'stopping', 'stopped']
+    TERMINABLE_STATES = ['pending', 'running', 'stopping', 'stopped']
+    TERMINATE_BATCH_SIZE = 100
+    MAX_WORKERS = 8
+    POLL_DELAY = 5
+    # Seconds agents are drained for when the stack delete does not return
+    DRAIN_TIMEOUT = 1800
 
 
 class master_config:
@@ -59,6 +273,9 @@ class master_config:
     MAX_IDLE_AGENT_PERIOD = 'max_idle_agent_period'
     PROVIDER = 'provider'
     ROOT_VOLUME_SIZE = 'root_volume_size'
+    ROOT_VOLUME_TYPE = 'root_volume_type'
+    ROOT_VOLUME_IOPS = 'root_volume_iops'
+    ROOT_VOLUME_THROUGHPUT = 'root_volume_throughput'
     IMAGE_ID = 'image_id'
     TAG_KEY = 'tag_key'
     TAG_VALUE = 'tag_value'
@@ -70,17 +287,20 @@ class master_config:
     INSTANCE_TYPE = 'instance_type'
     IAM_INSTANCE_PROFILE_ARN = 'iam_instance_profile_arn'
     MAX_INSTANCES = 'max_instances'
+    MIN_INSTANCES = 'min_instances'
     PUBLIC_IP = 'public_ip'
+    SPOT = 'spot'
 
     # Default Config Values
     DEFAULT_TAG_KEY = 'pedl'
     DEFAULT_TAG_VALUE = 'pedl-agent'
     DEFAULT_MASTER_URL = 'http://local-ipv4:8080'
     DEFAULT_DOCKER_NETWORK = 'pedl'
-    DEFAULT_MAX_IDLE_AGENT_PERIOD = '1m'
+    DEFAULT_MAX_IDLE_AGENT_PERIOD = '5m'
     DEFAULT_PROVIDER = 'aws'
     DEFAULT_ROOT_VOLUME_SIZE = 200
     DEFAULT_MAX_INSTANCES = 5
+    DEFAULT_MIN_INSTANCES = 0
     DEFAULT_INSTANCE_NAME = 'pedl-agent'
     DEFAULT_NETWORK_INTERFACE = {}
 
@@ -101,9 +321,38 @@ class master_config:
     }
 
 
+class agent_scaling:
+    FAST_SNAPSHOT_RESTORE = 'fast_snapshot_restore'
+    PLACEMENT_GROUP = 'placement_group'
+    # Keys of the --agent-config file, instance_type may also be a list in order of preference
+    CONFIG_KEYS = [
+        master_config.INSTANCE_TYPE,
+        master_config.MIN_INSTANCES,
+        master_config.MAX_INSTANCES,
+        master_config.MAX_IDLE_AGENT_PERIOD,
+        master_config.ROOT_VOLUME_SIZE,
+        master_config.ROOT_VOLUME_TYPE,
+        master_config.ROOT_VOLUME_IOPS,
+        master_config.ROOT_VOLUME_THROUGHPUT,
+        master_config.SPOT,
+        FAST_SNAPSHOT_RESTORE,
+        PLACEMENT_GROUP
+    ]
+    IDLE_PERIOD_PATTERN = r'^[0-9]+[smh]$'
+    SPOT = 'spot'
+    ON_DEMAND = 'on-demand'
+    SPOT_PRODUCT = 'Linux/UNIX'
+    # Cluster placement groups keep the agents of a multi node trial close together in one zone, the
+    # instances need enhanced networking to make use of it
+    PLACEMENT_STRATEGY = 'cluster'
+    ENA_UNSUPPORTED = 'unsupported'
+
+
 class misc:
     PEDL_MASTER_YAML_PATH = '/usr/local/pedl/etc/master.yaml'
     SECURE_SSH_COMMAND = 'ssh -i <pem-file>  ubuntu@{master_ip} -o ' \
                          '"proxycommand ssh -W %h:%p -i <pem-file> ubuntu@{bastion_ip}"'
     SIMPLE_SSH_COMMAND = 'ssh -i <pem-file>  ubuntu@{master_ip}'
     TEMPLATE_PATH = 'pedl_deploy.templates'
+    CACHE_DIR = '~/.pedl-deploy/cache'
+    STATE_DIR = '~/.pedl-deploy/state'
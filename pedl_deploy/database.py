@@ -0,0 +1,33 @@
+from pedl_deploy.constants import database
+
+
+def apply_database_config(args):
+    # A provisioned instance class replaces the serverless capacity settings instead of adding to them
+    capacity_flags = [flag for flag, value in [('--db-min-capacity', args.db_min_capacity),
+                                               ('--db-max-capacity', args.db_max_capacity),
+                                               ('--db-auto-pause', args.db_auto_pause)] if value is not None]
+    if args.db_instance_class:
+        if not args.db_instance_class.startswith(database.INSTANCE_CLASS_PREFIX):
+            raise ValueError(f'Invalid database instance class {args.db_instance_class}, '
+                             f'expected e.g. {database.INSTANCE_CLASS_PREFIX}r5.large')
+        if capacity_flags:
+            raise ValueError(f'{", ".join(capacity_flags)} can only be used with the serverless database, '
+                             f'not with --db-instance-class')
+
+    if args.db_min_capacity is None:
+        args.db_min_capacity = database.DEFAULT_MIN_CAPACITY
+    if args.db_max_capacity is None:
+        args.db_max_capacity = max(database.DEFAULT_MAX_CAPACITY, args.db_min_capacity)
+    if args.db_auto_pause is None:
+        args.db_auto_pause = database.DEFAULT_AUTO_PAUSE
+
+    if args.db_min_capacity > args.db_max_capacity:
+        raise ValueError(f'--db-min-capacity {args.db_min_capacity} is above --db-max-capacity '
+                         f'{args.db_max_capacity}')
+    low, high = database.AUTO_PAUSE_LIMITS
+    if args.db_auto_pause and not low <= args.db_auto_pause <= high:
+        raise ValueError(f'--db-auto-pause must be 0 or between {low} and {high} seconds')
+
+
+def engine_mode(instance_class):
+    return 'provisioned' if instance_class else 'serverless'
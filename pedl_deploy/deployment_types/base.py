@@ -1,13 +1,151 @@
+from pedl_deploy.aws import deploy_stack, describe_stack
+from pedl_deploy.constants import cloudformation, database, pedl_config, volumes
+from pedl_deploy.database import engine_mode
+from pedl_deploy.templating import render_template
+
+
+def read_template(template_name):
+    return render_template(template_name)
+
+
+def cfn_parameter(key, value):
+    return {
+        'ParameterKey': key,
+        'ParameterValue': value
+    }
+
+
 class PEDLDeployment:
+    template_name = None
+
     def __init__(self, template, parameters):
         self._template = template
         self._parameters = parameters
 
     def deploy(self):
+        # Returns the submitted operation when not waiting for it
+        parameters = self.parameters()
+        stack_name = parameters[pedl_config.PEDL_STACK_NAME]
+        cfn_parameters = self.stack_parameters()
+        template = self.stack_template(cfn_parameters)
+
+        return deploy_stack(stack_name, template, parameters[pedl_config.BOTO3_SESSION], parameters=cfn_parameters,
+                            plan=parameters[pedl_config.PLAN], wait=parameters[pedl_config.WAIT])
+
+    def stack_template(self, cfn_parameters):
+        # The template to deploy, subclasses add the parameters that only their template takes
+        return self.template_body()
+
+    def addresses(self, stack_name, boto3_session):
+        # The addresses of the deployed instances, which the endpoint and the printed results are made of
+        raise NotImplementedError
+
+    def print_results(self, addresses):
+        raise NotImplementedError
+
+    def ui_endpoint(self, addresses):
+        raise NotImplementedError
+
+    def ready_url(self, addresses):
+        # The URL polled until the master serves, None when the stack itself waits for the master
         raise NotImplementedError
 
+    def agent_availability_zones(self, boto3_session):
+        # The zones the provisioner launches agents in
+        raise NotImplementedError
+
+    @classmethod
+    def pinned_agent_zone(cls, boto3_session):
+        # The zone the template launches the agents in whatever their instance type, which preflight checks the
+        # type against. None when the zone is picked among those offering the type.
+        return None
+
     def template(self):
         return self._template
 
+    def template_body(self):
+        return read_template(self._template)
+
     def parameters(self):
         return self._parameters
+
+    def master_volume(self):
+        parameters = self.parameters()
+        if parameters[pedl_config.MASTER_VOLUME] is not None:
+            return parameters[pedl_config.MASTER_VOLUME]
+
+        # Without --master-volume a deployed stack keeps its volume, the defaults only apply to new stacks. The
+        # throughput is left as is, it is only set on the volume when given.
+        stack = describe_stack(parameters[pedl_config.PEDL_STACK_NAME], parameters[pedl_config.BOTO3_SESSION])
+        if stack is None:
+            return {volumes.SIZE: volumes.DEFAULT_SIZE, volumes.TYPE: volumes.DEFAULT_TYPE, volumes.IOPS: None,
+                    volumes.THROUGHPUT: None}
+
+        current = {parameter['ParameterKey']: parameter.get('ParameterValue')
+                   for parameter in stack.get('Parameters', [])}
+        if cloudformation.MASTER_VOLUME_TYPE_KEY not in current:
+            print(f'Keeping the gp2 master volume of {stack["StackName"]}, changing it with --master-volume '
+                  f'replaces the master instance')
+            return volumes.LEGACY_MASTER_VOLUME
+        return {volumes.SIZE: current[cloudformation.MASTER_VOLUME_SIZE_KEY],
+                volumes.TYPE: current[cloudformation.MASTER_VOLUME_TYPE_KEY],
+                volumes.IOPS: current[cloudformation.MASTER_VOLUME_IOPS_KEY], volumes.THROUGHPUT: None}
+
+    def check_database(self):
+        # Switching between serverless and provisioned changes the engine mode, which replaces the cluster
+        parameters = self.parameters()
+        stack = describe_stack(parameters[pedl_config.PEDL_STACK_NAME], parameters[pedl_config.BOTO3_SESSION])
+        if not stack:
+            return
+
+        current = next((parameter['ParameterValue'] for parameter in stack.get('Parameters', [])
+                        if parameter['ParameterKey'] == cloudformation.DATABASE_INSTANCE_CLASS_KEY), '')
+        mode = engine_mode(parameters[pedl_config.DATABASE_INSTANCE_CLASS])
+        if engine_mode(current) != mode:
+            print(f'Changing the database of {stack["StackName"]} from {engine_mode(current)} to {mode} replaces '
+                  f'the database cluster and loses its data, use --plan to review the change')
+
+    def stack_parameters(self):
+        # The parameters every template takes, including the agent fleet, volumes, checkpoint storage and database
+        parameters = self.parameters()
+        master_volume = self.master_volume()
+        self.check_database()
+        auto_pause = parameters[pedl_config.DATABASE_AUTO_PAUSE]
+        agent_volume = parameters[pedl_config.AGENT_VOLUME]
+        return [
+            cfn_parameter(cloudformation.USER_NAME_KEY, parameters[pedl_config.USER]),
+            cfn_parameter(cloudformation.KEYPAIR_KEY, parameters[pedl_config.KEYPAIR]),
+            cfn_parameter(cloudformation.MASTER_AMI_KEY, parameters[pedl_config.MASTER_AMI]),
+            cfn_parameter(cloudformation.MASTER_INSTANCE_TYPE, parameters[pedl_config.MASTER_INSTANCE_TYPE]),
+            cfn_parameter(cloudformation.AGENT_AMI_KEY, parameters[pedl_config.AGENT_AMI]),
+            cfn_parameter(cloudformation.AGENT_INSTANCE_TYPE, parameters[pedl_config.AGENT_INSTANCE_TYPE]),
+            cfn_parameter(cloudformation.MIN_AGENT_INSTANCES_KEY, str(parameters[pedl_config.MIN_AGENT_INSTANCES])),
+            cfn_parameter(cloudformation.MAX_AGENT_INSTANCES_KEY, str(parameters[pedl_config.MAX_AGENT_INSTANCES])),
+            cfn_parameter(cloudformation.MAX_IDLE_AGENT_PERIOD_KEY, parameters[pedl_config.MAX_IDLE_AGENT_PERIOD]),
+            cfn_parameter(cloudformation.AGENT_SPOT_KEY, 'true' if parameters[pedl_config.AGENT_SPOT] else 'false'),
+            cfn_parameter(cloudformation.AGENT_PLACEMENT_GROUP_KEY,
+                          'true' if parameters[pedl_config.AGENT_PLACEMENT_GROUP] else 'false'),
+            cfn_parameter(cloudformation.MASTER_VOLUME_SIZE_KEY, str(master_volume[volumes.SIZE])),
+            cfn_parameter(cloudformation.MASTER_VOLUME_TYPE_KEY, master_volume[volumes.TYPE]),
+            cfn_parameter(cloudformation.MASTER_VOLUME_IOPS_KEY,
+                          str(master_volume[volumes.IOPS] or volumes.DEFAULT_IOPS)),
+            cfn_parameter(cloudformation.AGENT_ROOT_VOLUME_SIZE_KEY, str(agent_volume[volumes.SIZE])),
+            cfn_parameter(cloudformation.AGENT_ROOT_VOLUME_TYPE_KEY, agent_volume[volumes.TYPE]),
+            cfn_parameter(cloudformation.AGENT_ROOT_VOLUME_IOPS_KEY,
+                          str(agent_volume[volumes.IOPS] or volumes.DEFAULT_IOPS)),
+            cfn_parameter(cloudformation.AGENT_ROOT_VOLUME_THROUGHPUT_KEY,
+                          str(agent_volume[volumes.THROUGHPUT] or volumes.DEFAULT_THROUGHPUT)),
+            cfn_parameter(cloudformation.SAVE_EXPERIMENT_BEST_KEY, str(parameters[pedl_config.SAVE_EXPERIMENT_BEST])),
+            cfn_parameter(cloudformation.SAVE_TRIAL_BEST_KEY, str(parameters[pedl_config.SAVE_TRIAL_BEST])),
+            cfn_parameter(cloudformation.SAVE_TRIAL_LATEST_KEY, str(parameters[pedl_config.SAVE_TRIAL_LATEST])),
+            cfn_parameter(cloudformation.CHECKPOINT_EXPIRATION_DAYS_KEY,
+                          str(parameters[pedl_config.CHECKPOINT_EXPIRATION_DAYS])),
+            cfn_parameter(cloudformation.ABORT_MULTIPART_UPLOAD_DAYS_KEY,
+                          str(parameters[pedl_config.ABORT_MULTIPART_UPLOAD_DAYS])),
+            cfn_parameter(cloudformation.DATABASE_INSTANCE_CLASS_KEY, parameters[pedl_config.DATABASE_INSTANCE_CLASS]),
+            cfn_parameter(cloudformation.DATABASE_MIN_CAPACITY_KEY, str(parameters[pedl_config.DATABASE_MIN_CAPACITY])),
+            cfn_parameter(cloudformation.DATABASE_MAX_CAPACITY_KEY, str(parameters[pedl_config.DATABASE_MAX_CAPACITY])),
+            cfn_parameter(cloudformation.DATABASE_AUTO_PAUSE_KEY, 'true' if auto_pause else 'false'),
+            cfn_parameter(cloudformation.DATABASE_SECONDS_UNTIL_AUTO_PAUSE_KEY,
+                          str(auto_pause or database.DEFAULT_AUTO_PAUSE))
+        ]
@@ -1,11 +1,10 @@
-import pkg_resources
-
-from pedl_deploy.aws import deploy_stack, get_output, get_ec2_info
+from pedl_deploy.aws import availability_zones, describe_stack, get_output, get_ec2_info
 from pedl_deploy.constants import *
-from pedl_deploy.deployment_types.base import PEDLDeployment
+from pedl_deploy.deployment_types.base import cfn_parameter
+from pedl_deploy.deployment_types.shared_network import SharedNetworkDeployment
 
 
-class Secure(PEDLDeployment):
+class Secure(SharedNetworkDeployment):
     ssh_command = 'SSH to PEDL Master: ssh -i  <keypair> ubuntu@{master_ip} -o ' \
                   '"proxycommand ssh -W %h:%p -i <keypair> ubuntu@{bastion_ip}"'
     pedl_ui = 'To View PEDL UI:\n' \
@@ -13,61 +12,53 @@ class Secure(PEDLDeployment):
               'Open SSH Tunnel through Bastion:  ssh -N -L 8080:{master_ip}:8080 ubuntu@{bastion_ip}\n' \
               'View the PEDL UI: http://localhost:8080'
 
+    template_name = resources.SHARED_SECURE
+    standalone_template_name = resources.SECURE
 
     def __init__(self, parameters):
-        template = pkg_resources.resource_filename('pedl_deploy.templates', 'secure.yaml')
-        super().__init__(template, parameters)
+        super().__init__(self.template_name, parameters)
+
+    def stack_template(self, cfn_parameters):
+        cfn_parameters.append(cfn_parameter(cloudformation.BASTION_AMI_KEY, defaults.BASTION_AMI))
+        # The master has no public address, so the stack waits until it serves instead of it being polled
+        cfn_parameters.append(cfn_parameter(cloudformation.WAIT_FOR_MASTER_KEY, self.wait_for_master()))
+        return super().stack_template(cfn_parameters)
 
-    def deploy(self):
+    def wait_for_master(self):
+        # A stack keeps waiting for its master once deployed with --wait-ready, so later deploys without it stay no-ops
         parameters = self.parameters()
-        cfn_parameters = [
-            {
-                'ParameterKey': cloudformation.USER_NAME_KEY,
-                'ParameterValue': parameters[pedl_config.USER]
-            },
-            {
-                'ParameterKey': cloudformation.KEYPAIR_KEY,
-                'ParameterValue': parameters[pedl_config.KEYPAIR]
-            },
-            {
-                'ParameterKey': cloudformation.BASTION_AMI_KEY,
-                'ParameterValue': defaults.BASTION_AMI
-            },
-            {
-                'ParameterKey': cloudformation.MASTER_AMI_KEY,
-                'ParameterValue': parameters[pedl_config.MASTER_AMI]
-            },
-            {
-                'ParameterKey': cloudformation.MASTER_INSTANCE_TYPE,
-                'ParameterValue': parameters[pedl_config.MASTER_INSTANCE_TYPE]
-            },
-            {
-                'ParameterKey': cloudformation.AGENT_AMI_KEY,
-                'ParameterValue': parameters[pedl_config.AGENT_AMI]
-            },
-            {
-                'ParameterKey': cloudformation.AGENT_INSTANCE_TYPE,
-                'ParameterValue': parameters[pedl_config.AGENT_INSTANCE_TYPE]
-            }
-        ]
+        if parameters[pedl_config.WAIT_READY]:
+            return 'true'
 
-        with open(self.template()) as f:
-            template = f.read()
+        stack = describe_stack(parameters[pedl_config.PEDL_STACK_NAME], parameters[pedl_config.BOTO3_SESSION])
+        return next((parameter['ParameterValue'] for parameter in (stack or {}).get('Parameters', [])
+                     if parameter['ParameterKey'] == cloudformation.WAIT_FOR_MASTER_KEY), 'false')
 
-        deploy_stack(parameters[pedl_config.PEDL_STACK_NAME], template,
-                     parameters[pedl_config.BOTO3_SESSION], parameters=cfn_parameters)
-        self.print_results(parameters[pedl_config.PEDL_STACK_NAME], parameters[pedl_config.BOTO3_SESSION])
+    @classmethod
+    def pinned_agent_zone(cls, boto3_session):
+        return availability_zones(boto3_session)[0]
 
-    def print_results(self, stack_name, boto3_session):
+    def agent_availability_zones(self, boto3_session):
+        # The agents share the private master subnet in the first zone of the region
+        return [self.pinned_agent_zone(boto3_session)]
+
+    def addresses(self, stack_name, boto3_session):
         output = get_output(stack_name, boto3_session)
+        bastion = get_ec2_info(output[cloudformation.BASTION_ID], boto3_session)
+        master = get_ec2_info(output[cloudformation.MASTER_ID], boto3_session)
+        return {'master_ip': master[cloudformation.PRIVATE_IP_ADDRESS],
+                'bastion_ip': bastion[cloudformation.PUBLIC_IP_ADDRESS]}
+
+    def ui_endpoint(self, addresses):
+        return f'http://localhost:8080 (tunnel to {addresses["master_ip"]}:8080 through bastion ' \
+               f'{addresses["bastion_ip"]})'
 
-        bastion_ip = get_ec2_info(output['BastionId'], boto3_session)[cloudformation.PUBLIC_IP_ADDRESS]
-        master_ip = get_ec2_info(output['MasterId'], boto3_session)[cloudformation.PRIVATE_IP_ADDRESS]
+    def ready_url(self, addresses):
+        return None
 
-        ui_command = self.pedl_ui.format(master_ip=master_ip, bastion_ip=bastion_ip)
-        print(ui_command)
+    def print_results(self, addresses):
+        print(self.pedl_ui.format(**addresses))
         print()
 
-        ssh_command = self.ssh_command.format(master_ip=master_ip, bastion_ip=bastion_ip)
-        print(ssh_command)
+        print(self.ssh_command.format(**addresses))
         print()
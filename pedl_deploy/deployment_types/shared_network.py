@@ -0,0 +1,19 @@
+from pedl_deploy.constants import pedl_config
+from pedl_deploy.deployment_types.base import PEDLDeployment, read_template
+from pedl_deploy.network import network_parameters
+
+
+class SharedNetworkDeployment(PEDLDeployment):
+    # Deploys into the shared network stack of the region, or with a network of its own when an existing
+    # stack still has one
+    standalone_template_name = None
+
+    def stack_template(self, cfn_parameters):
+        parameters = self.parameters()
+        shared_network = network_parameters(parameters[pedl_config.PEDL_STACK_NAME],
+                                            parameters[pedl_config.BOTO3_SESSION], parameters[pedl_config.PLAN])
+        if shared_network is None:
+            return read_template(self.standalone_template_name)
+
+        cfn_parameters.extend(shared_network)
+        return self.template_body()
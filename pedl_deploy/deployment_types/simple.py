@@ -1,59 +1,52 @@
-import pkg_resources
-
-from pedl_deploy.aws import deploy_stack, get_output, get_ec2_info
+from pedl_deploy.aws import default_subnet_zones, default_subnets, get_output, get_ec2_info, instance_type_zones
 from pedl_deploy.constants import *
-from pedl_deploy.deployment_types.base import PEDLDeployment
+from pedl_deploy.deployment_types.base import PEDLDeployment, cfn_parameter
 
 
 class Simple(PEDLDeployment):
     ssh_command = 'SSH to master Instance: ssh -i <pem-file> ubuntu@{master_ip}'
     pedl_ui = 'View the PEDL UI: http://{master_ip}:8080'
 
+    template_name = resources.SIMPLE
+
     def __init__(self, parameters):
-        template = pkg_resources.resource_filename('pedl_deploy.templates', 'simple.yaml')
-        super().__init__(template, parameters)
+        super().__init__(self.template_name, parameters)
 
-    def deploy(self):
+    def agent_subnet(self, boto3_session):
+        # A placement group lives in one zone, so its agents are pinned to the default subnet of the first zone
+        # offering their instance type
         parameters = self.parameters()
-        cfn_parameters = [
-            {
-                'ParameterKey': cloudformation.USER_NAME_KEY,
-                'ParameterValue': parameters[pedl_config.USER]
-            },
-            {
-                'ParameterKey': cloudformation.KEYPAIR_KEY,
-                'ParameterValue': parameters[pedl_config.KEYPAIR]
-            },
-            {
-                'ParameterKey': cloudformation.MASTER_AMI_KEY,
-                'ParameterValue': parameters[pedl_config.MASTER_AMI]
-            },
-            {
-                'ParameterKey': cloudformation.MASTER_INSTANCE_TYPE,
-                'ParameterValue': parameters[pedl_config.MASTER_INSTANCE_TYPE]
-            },
-            {
-                'ParameterKey': cloudformation.AGENT_AMI_KEY,
-                'ParameterValue': parameters[pedl_config.AGENT_AMI]
-            },
-            {
-                'ParameterKey': cloudformation.AGENT_INSTANCE_TYPE,
-                'ParameterValue': parameters[pedl_config.AGENT_INSTANCE_TYPE]
-            }
-        ]
-
-        with open(self.template()) as f:
-            template = f.read()
-
-        deploy_stack(parameters[pedl_config.PEDL_STACK_NAME], template,
-                     parameters[pedl_config.BOTO3_SESSION], parameters=cfn_parameters)
-        self.print_results(parameters[pedl_config.PEDL_STACK_NAME], parameters[pedl_config.BOTO3_SESSION])
-
-    def print_results(self, stack_name, boto3_session):
+        if not parameters[pedl_config.AGENT_PLACEMENT_GROUP]:
+            return None
+        subnets = default_subnets(boto3_session)
+        if not subnets:
+            return None
+        instance_type = parameters[pedl_config.AGENT_INSTANCE_TYPE]
+        offered = instance_type_zones([instance_type], boto3_session).get(instance_type, set())
+        zone = next((zone for zone in sorted(subnets) if zone in offered), min(subnets))
+        return zone, subnets[zone]
+
+    def stack_template(self, cfn_parameters):
+        agent_subnet = self.agent_subnet(self.parameters()[pedl_config.BOTO3_SESSION])
+        cfn_parameters.append(cfn_parameter(cloudformation.AGENT_SUBNET_KEY, agent_subnet[1] if agent_subnet else ''))
+        return super().stack_template(cfn_parameters)
+
+    def agent_availability_zones(self, boto3_session):
+        # Without a subnet in the provisioner config EC2 picks any default subnet
+        agent_subnet = self.agent_subnet(boto3_session)
+        return [agent_subnet[0]] if agent_subnet else default_subnet_zones(boto3_session)
+
+    def addresses(self, stack_name, boto3_session):
         output = get_output(stack_name, boto3_session)
-        master_ip = get_ec2_info(output[cloudformation.MASTER_ID], boto3_session)[cloudformation.PUBLIC_IP_ADDRESS]
-        ui_command = self.pedl_ui.format(master_ip=master_ip)
-        print(ui_command)
+        master = get_ec2_info(output[cloudformation.MASTER_ID], boto3_session)
+        return {'master_ip': master[cloudformation.PUBLIC_IP_ADDRESS]}
+
+    def ui_endpoint(self, addresses):
+        return f'http://{addresses["master_ip"]}:8080'
+
+    def ready_url(self, addresses):
+        return self.ui_endpoint(addresses)
 
-        ssh_command = self.ssh_command.format(master_ip=master_ip)
-        print(ssh_command)
+    def print_results(self, addresses):
+        print(self.pedl_ui.format(**addresses))
+        print(self.ssh_command.format(**addresses))
@@ -1,59 +1,37 @@
-import pkg_resources
-
-from pedl_deploy.aws import deploy_stack, get_output, get_ec2_info
+from pedl_deploy.aws import availability_zones, get_output, get_ec2_info
 from pedl_deploy.constants import *
-from pedl_deploy.deployment_types.base import PEDLDeployment
+from pedl_deploy.deployment_types.shared_network import SharedNetworkDeployment
 
 
-class VPC(PEDLDeployment):
+class VPC(SharedNetworkDeployment):
     ssh_command = 'SSH to master Instance: ssh -i <pem-file> ubuntu@{master_ip}'
     pedl_ui = 'View the PEDL UI: http://{master_ip}:8080'
 
+    template_name = resources.SHARED_VPC
+    standalone_template_name = resources.VPC
+
     def __init__(self, parameters):
-        template = pkg_resources.resource_filename('pedl_deploy.templates', 'vpc.yaml')
-        super().__init__(template, parameters)
-
-    def deploy(self):
-        parameters = self.parameters()
-        cfn_parameters = [
-            {
-                'ParameterKey': cloudformation.USER_NAME_KEY,
-                'ParameterValue': parameters[pedl_config.USER]
-            },
-            {
-                'ParameterKey': cloudformation.KEYPAIR_KEY,
-                'ParameterValue': parameters[pedl_config.KEYPAIR]
-            },
-            {
-                'ParameterKey': cloudformation.MASTER_AMI_KEY,
-                'ParameterValue': parameters[pedl_config.MASTER_AMI]
-            },
-            {
-                'ParameterKey': cloudformation.MASTER_INSTANCE_TYPE,
-                'ParameterValue': parameters[pedl_config.MASTER_INSTANCE_TYPE]
-            },
-            {
-                'ParameterKey': cloudformation.AGENT_AMI_KEY,
-                'ParameterValue': parameters[pedl_config.AGENT_AMI]
-            },
-            {
-                'ParameterKey': cloudformation.AGENT_INSTANCE_TYPE,
-                'ParameterValue': parameters[pedl_config.AGENT_INSTANCE_TYPE]
-            }
-        ]
-
-        with open(self.template()) as f:
-            template = f.read()
-
-        deploy_stack(parameters[pedl_config.PEDL_STACK_NAME], template,
-                     parameters[pedl_config.BOTO3_SESSION], parameters=cfn_parameters)
-        self.print_results(parameters[pedl_config.PEDL_STACK_NAME], parameters[pedl_config.BOTO3_SESSION])
-
-    def print_results(self, stack_name, boto3_session):
+        super().__init__(self.template_name, parameters)
+
+    @classmethod
+    def pinned_agent_zone(cls, boto3_session):
+        return availability_zones(boto3_session)[0]
+
+    def agent_availability_zones(self, boto3_session):
+        # The agents share the master subnet in the first zone of the region
+        return [self.pinned_agent_zone(boto3_session)]
+
+    def addresses(self, stack_name, boto3_session):
         output = get_output(stack_name, boto3_session)
-        master_ip = get_ec2_info(output[cloudformation.MASTER_ID], boto3_session)[cloudformation.PUBLIC_IP_ADDRESS]
-        ui_command = self.pedl_ui.format(master_ip=master_ip)
-        print(ui_command)
+        master = get_ec2_info(output[cloudformation.MASTER_ID], boto3_session)
+        return {'master_ip': master[cloudformation.PUBLIC_IP_ADDRESS]}
+
+    def ui_endpoint(self, addresses):
+        return f'http://{addresses["master_ip"]}:8080'
+
+    def ready_url(self, addresses):
+        return self.ui_endpoint(addresses)
 
-        ssh_command = self.ssh_command.format(master_ip=master_ip)
-        print(ssh_command)
+    def print_results(self, addresses):
+        print(self.pedl_ui.format(**addresses))
+        print(self.ssh_command.format(**addresses))
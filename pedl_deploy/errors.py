@@ -0,0 +1,33 @@
+class PEDLDeployError(Exception):
+    # The library raises these instead of exiting, the CLI prints them and exits with 1
+    pass
+
+
+class ConfigError(PEDLDeployError, ValueError):
+    pass
+
+
+class PreflightError(PEDLDeployError):
+    pass
+
+
+class TemplateError(PEDLDeployError):
+    pass
+
+
+class AmiError(PEDLDeployError):
+    pass
+
+
+class BucketError(PEDLDeployError):
+    pass
+
+
+class StackError(PEDLDeployError):
+    def __init__(self, stack_name, message):
+        super().__init__(message)
+        self.stack_name = stack_name
+
+
+class MasterNotReadyError(StackError):
+    pass
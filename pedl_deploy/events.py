@@ -0,0 +1,85 @@
+import time
+
+from pedl_deploy.constants import stack_events
+from pedl_deploy.errors import StackError
+from pedl_deploy.timings import record_event
+
+
+def latest_event_id(stack_id, cfn):
+    events = cfn.describe_stack_events(StackName=stack_id)['StackEvents']
+    if events:
+        return events[0]['EventId']
+    return None
+
+
+def new_events(stack_id, cfn, last_event_id):
+    # describe_stack_events returns the newest events first, so paging stops as soon as
+    # the last seen event shows up instead of re-reading the whole stack history.
+    events = []
+    kwargs = {'StackName': stack_id}
+    while True:
+        response = cfn.describe_stack_events(**kwargs)
+        for event in response['StackEvents']:
+            if event['EventId'] == last_event_id:
+                return events[::-1]
+            events.append(event)
+
+        if 'NextToken' not in response:
+            return events[::-1]
+        kwargs['NextToken'] = response['NextToken']
+
+
+def print_event(stack_name, event):
+    line = f'{event["Timestamp"]:%H:%M:%S} {stack_name} {event["LogicalResourceId"]} ' \
+           f'({event["ResourceType"]}) {event["ResourceStatus"]}'
+    if event.get('ResourceStatusReason'):
+        line += f' - {event["ResourceStatusReason"]}'
+    print(line)
+
+
+def is_stack_event(stack_name, event):
+    return event['ResourceType'] == stack_events.STACK_RESOURCE_TYPE and event['LogicalResourceId'] == stack_name
+
+
+def wait_for_stack(stack_name, stack_id, cfn, last_event_id=None, on_event=None):
+    start = time.time()
+    delay = stack_events.MIN_POLL_DELAY
+    in_progress = set()
+    completed = set()
+
+    while True:
+        for event in new_events(stack_id, cfn, last_event_id):
+            last_event_id = event['EventId']
+            print_event(stack_name, event)
+            record_event(cfn.meta.region_name, stack_name, event)
+            if on_event:
+                on_event(event)
+            status = event['ResourceStatus']
+
+            if is_stack_event(stack_name, event):
+                if status in stack_events.SUCCESS_STATUSES:
+                    return event
+                if status.endswith('_FAILED') or 'ROLLBACK' in status:
+                    raise StackError(stack_name, f'{stack_name} failed with status {status}')
+                continue
+
+            # Fail on the first failed resource instead of waiting for the rollback to finish
+            if status.endswith('_FAILED'):
+                raise StackError(stack_name, f'{stack_name} failed: {event["LogicalResourceId"]} {status}')
+
+            if status.endswith('_IN_PROGRESS'):
+                in_progress.add(event['LogicalResourceId'])
+            else:
+                in_progress.discard(event['LogicalResourceId'])
+                completed.add(event['LogicalResourceId'])
+
+        # Poll fast right after the submit and once every started resource has finished,
+        # since the stack is then about to complete. Back off while resources are still running.
+        near_completion = completed and not in_progress
+        if time.time() - start < stack_events.FAST_POLL_PERIOD or near_completion:
+            delay = stack_events.MIN_POLL_DELAY
+        else:
+            delay = min(delay * stack_events.POLL_BACKOFF, stack_events.MAX_POLL_DELAY)
+        if time.time() - start + delay > stack_events.TIMEOUT:
+            raise StackError(stack_name, f'{stack_name} did not finish within {stack_events.TIMEOUT}s')
+        time.sleep(delay)
@@ -1,97 +1,258 @@
-import argparse
 import sys
+import time
 
-from pedl_deploy.aws import get_output, delete_stack, session, empty_bucket, get_latest_release_amis, check_keypair
 from pedl_deploy.constants import *
-from pedl_deploy.deployment_types.simple import Simple
-from pedl_deploy.deployment_types.secure import Secure
-from pedl_deploy.deployment_types.vpc import VPC
+from pedl_deploy.errors import ConfigError, PEDLDeployError
+from pedl_deploy.options import build_parser
 
+# The CLI over pedl_deploy.api, it prints the results and turns the errors into exit codes.
+# Modules that pull in boto3 are imported inside the functions that need them,
+# so --help and argument errors do not pay for importing boto3.
 
-def get_user(boto3_session):
-    sts = boto3_session.client('sts')
-    response = sts.get_caller_identity()
-    return response['Arn'].split('/')[-1]
 
+def submitted(pending):
+    from pedl_deploy.state import save_state
 
-def delete(stack_name, boto3_session):
-    bucket_name = get_output(stack_name, boto3_session).get(cloudformation.CHECKPOINT_BUCKET)
-    if bucket_name:
-        empty_bucket(bucket_name, boto3_session)
+    save_state(pending)
+    print(f'Submitted {pending["operation"]} of {pending["stack_name"]}, follow it with pedl-deploy --wait')
 
-    delete_stack(stack_name, boto3_session)
 
+def print_deploy_result(result):
+    from pedl_deploy import api
 
-def main():
-    parser = argparse.ArgumentParser(description='Package for deploying PEDL to AWS')
-    parser.add_argument('--delete', action='store_true',
-                        help='Delete PEDL from account')
-    parser.add_argument('--deployment-type', type=str, default=defaults.DEPLOYMENT_TYPE,
-                        help=f'deployment type - must be one of [{", ".join(deployment_types.DEPLOYMENT_TYPES)}]')
-    parser.add_argument('--master-ami', type=str, default=None,
-                        help='ami for pedl master')
-    parser.add_argument('--agent-ami', type=str, default=None,
-                        help='ami for pedl agent')
-    parser.add_argument('--keypair', type=str, default=defaults.KEYPAIR_NAME,
-                        help='keypair for master and agent')
-    parser.add_argument('--master-instance-type', type=str,
-                        default=defaults.MASTER_INSTANCE_TYPE,
-                        help='instance type for master')
-    parser.add_argument('--agent-instance-type', type=str,
-                        default=defaults.AGENT_INSTANCE_TYPE,
-                        help='instance type for agent')
-    parser.add_argument('--user', type=str,
-                        default=None,
-                        help='user to name stack and tag resources')
-    parser.add_argument('--aws-profile', type=str,
-                        default=None,
-                        help='aws profile for deploying')
-    args = parser.parse_args()
+    if result.pending:
+        submitted(result.pending)
+        return
+    if result.plan:
+        return
+    if result.addresses:
+        api.deployment_class(result.deployment_type)({}).print_results(result.addresses)
+    if result.ready_seconds is not None:
+        print(f'PEDL master of {result.stack_name} ready {result.ready_seconds:.0f}s after the deploy started')
+    print(f'PEDL Deployment of {result.stack_name} Successful')
 
-    boto3_session = session(args.aws_profile)
-    user = args.user if args.user else get_user(boto3_session)
-    stack_name = defaults.PEDL_STACK_NAME_BASE.format(user)
-    if args.delete:
-        delete(stack_name, boto3_session)
-        print('Delete Successful')
+
+def delete(user, boto3_session, wait=True, usage=None):
+    from pedl_deploy import api
+
+    result = api.delete_stack(user, boto3_session, wait, usage)
+    if result.pending:
+        submitted(result.pending)
+    return result
+
+
+def deploy(deployment_type, pedl_configs):
+    from pedl_deploy import api
+
+    print(f'Starting PEDL Deployment of {pedl_configs[pedl_config.PEDL_STACK_NAME]}')
+    result = api.deploy_stack(deployment_type, pedl_configs)
+    print_deploy_result(result)
+    return result
+
+
+def wait_for_pending(state, boto3_session):
+    from pedl_deploy import api
+
+    print(f'Waiting for {state["operation"]} of {state["stack_name"]} in {state["region"]}, '
+          f'started {time.time() - state["started"]:.0f}s ago')
+    result = api.wait_for_operation(state, boto3_session)
+    if state['operation'] == 'delete':
+        print(f'Delete of {state["stack_name"]} Successful')
+    else:
+        print_deploy_result(result)
+
+
+def wait(args, users):
+    from pedl_deploy import api
+    from pedl_deploy.batch import print_summary, run_batch
+    from pedl_deploy.state import load_states
+
+    if args.all:
+        states = load_states()
+    else:
+        if not users:
+            users = [args.user if args.user else api.get_user(api.session(args.aws_profile))]
+        states = load_states({defaults.PEDL_STACK_NAME_BASE.format(user) for user in users})
+
+    if not states:
+        print('No submitted operations to wait for')
         return
 
-    check_keypair(args.keypair, boto3_session)
+    sessions = {region: api.session(args.aws_profile, region) for region in {state['region'] for state in states}}
+    if len(states) == 1:
+        wait_for_pending(states[0], sessions[states[0]['region']])
+        return
+
+    pending = {f'{state["stack_name"]} ({state["region"]})': state for state in states}
+    results = run_batch(list(pending),
+                        lambda name: wait_for_pending(pending[name], sessions[pending[name]['region']]),
+                        args.max_workers)
+    print_summary(results, '{}')
+    if any(error is not None for error in results.values()):
+        sys.exit(1)
+
 
-    if args.master_ami and args.agent_ami:
-        master_ami, agent_ami = args.master_ami, args.agent_ami
+def batch(args, users):
+    from pedl_deploy import api
+    from pedl_deploy.batch import run_batch, print_summary
+    from pedl_deploy.preflight import check_stack
+    from pedl_deploy.snapshots import StackUsage
+
+    # All stacks share one session and its pooled clients.
+    # The shared preflight checks, including the AMI lookup, only run once for the whole batch. The state of each
+    # stack is checked in its own task and a blocked stack shows up as failed in the summary.
+    boto3_session = api.session(args.aws_profile)
+    if args.delete:
+        usage = StackUsage([defaults.PEDL_STACK_NAME_BASE.format(user) for user in users], boto3_session)
+
+        def task(user):
+            delete(user, boto3_session, not args.no_wait, usage)
+    else:
+        master_ami, agent_ami, agents = api.preflight(args, boto3_session, batch=True)
+
+        def task(user):
+            check_stack(user, boto3_session)
+            if not args.preflight_only:
+                deploy(args.deployment_type,
+                       api.pedl_configs(args, user, master_ami, agent_ami, agents, boto3_session))
+
+    results = run_batch(users, task, args.max_workers)
+    print_summary(results, defaults.PEDL_STACK_NAME_BASE)
+
+    if any(error is not None for error in results.values()):
+        sys.exit(1)
+
+
+def multi_region(args, regions):
+    from pedl_deploy import api
+    from pedl_deploy.batch import run_batch
+    from pedl_deploy.regions import check_regions, print_endpoints, replicate_amis
+
+    source_session = api.session(args.aws_profile)
+    sessions = {region: api.session(args.aws_profile, region) for region in regions}
+    user = args.user if args.user else api.get_user(source_session)
+
+    if args.delete:
+        results = run_batch(regions, lambda region: delete(user, sessions[region], not args.no_wait),
+                            len(regions))
+        print_endpoints(results, {})
     else:
-        if args.aws_profile:
-            print('Profile must explicitly set ami ids')
-            sys.exit(1)
-
-        master_ami, agent_ami = get_latest_release_amis(boto3_session)
-
-    pedl_configs = {
-        pedl_config.MASTER_AMI: master_ami,
-        pedl_config.AGENT_AMI: agent_ami,
-        pedl_config.KEYPAIR: args.keypair,
-        pedl_config.MASTER_INSTANCE_TYPE: args.master_instance_type,
-        pedl_config.AGENT_INSTANCE_TYPE: args.agent_instance_type,
-        pedl_config.USER: user,
-        pedl_config.PEDL_STACK_NAME: stack_name,
-        pedl_config.BOTO3_SESSION: boto3_session
-    }
-
-    deployment_type_map = {
-        deployment_types.SIMPLE: Simple,
-        deployment_types.SECURE: Secure,
-        deployment_types.VPC: VPC
-    }
+        # The AMIs are resolved once in the source region and copied to the other regions
+        master_ami, agent_ami, _ = api.preflight(args, source_session)
+        # Each region deploys the agent instance type and market it offers
+        agents = check_regions(args, user, api.deployment_class(args.deployment_type), sessions)
+        if args.preflight_only:
+            return
+
+        copies = replicate_amis(master_ami, agent_ami, source_session, sessions)
+        endpoints = {}
+
+        def task(region):
+            result = deploy(args.deployment_type, api.pedl_configs(args, user, copies[region][0], copies[region][1],
+                                                                   agents[region], sessions[region]))
+            if result.endpoint:
+                endpoints[region] = result.endpoint
+
+        results = run_batch(regions, task, len(regions))
+        print_endpoints(results, endpoints)
+
+    if any(error is not None for error in results.values()):
+        sys.exit(1)
+
+
+def main():
+    parser = build_parser()
+    args = parser.parse_args()
 
     assert args.deployment_type in deployment_types.DEPLOYMENT_TYPES, \
         f'deployment type - must be one of [{", ".join(deployment_types.DEPLOYMENT_TYPES)}]'
 
-    deployment_object = deployment_type_map[args.deployment_type](pedl_configs)
+    if args.stats:
+        from pedl_deploy import stats
+        stats.install()
+
+    try:
+        run(args, parser)
+    except ConfigError as e:
+        parser.error(str(e))
+    except PEDLDeployError as e:
+        print(e)
+        sys.exit(1)
+    finally:
+        if args.stats:
+            stats.print_summary()
+        if args.timings or args.timings_json:
+            from pedl_deploy import timings
+
+            if args.timings:
+                timings.print_report()
+            if args.timings_json:
+                timings.write_json(args.timings_json)
+
+
+def status(args, users):
+    from pedl_deploy import api
+    from pedl_deploy.status import print_status
+
+    boto3_session = api.session(args.aws_profile)
+    if not args.all and not users:
+        users = [args.user if args.user else api.get_user(boto3_session)]
+    print_status(api.status(boto3_session, None if args.all else users), args.json)
+
+
+def run(args, parser):
+    from pedl_deploy.batch import read_users
+
+    users = read_users(args.users, args.users_file)
+    if args.delete_network and (users or args.regions):
+        parser.error('--delete-network can not be combined with --users, --users-file or --regions')
+
+    if args.status:
+        status(args, users)
+        return
+
+    if args.wait:
+        wait(args, users)
+        return
+
+    from pedl_deploy import api
+
+    api.configure(args)
+
+    if args.regions:
+        if users:
+            parser.error('--regions can not be combined with --users or --users-file')
+        regions = [region.strip() for region in args.regions.split(',') if region.strip()]
+        multi_region(args, list(dict.fromkeys(regions)))
+        return
+
+    if users:
+        if args.user:
+            parser.error('--user can not be combined with --users or --users-file')
+        batch(args, users)
+        return
+
+    boto3_session = api.session(args.aws_profile)
+    if args.delete_network:
+        from pedl_deploy.aws import delete_stack
+
+        delete_stack(network.STACK_NAME, boto3_session)
+        print('Delete Successful')
+        return
+
+    if args.delete:
+        user = args.user if args.user else api.get_user(boto3_session)
+        delete(user, boto3_session, not args.no_wait)
+        if not args.no_wait:
+            print('Delete Successful')
+        return
+
+    master_ami, agent_ami, agents = api.preflight(args, boto3_session)
+    if args.preflight_only:
+        return
 
-    print('Starting PEDL Deployment')
-    deployment_object.deploy()
-    print('PEDL Deployment Successful')
+    user = args.user if args.user else api.get_user(boto3_session)
+    deploy(args.deployment_type, api.pedl_configs(args, user, master_ami, agent_ami, agents, boto3_session))
 
 
 if __name__ == '__main__':
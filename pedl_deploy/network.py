@@ -0,0 +1,81 @@
+import threading
+
+from pedl_deploy.aws import deploy_stack, describe_stack, invalidate_stack
+from pedl_deploy.clients import client
+from pedl_deploy.constants import cloudformation, network, resources, stack_status
+from pedl_deploy.deployment_types.base import cfn_parameter, read_template
+from pedl_deploy.errors import StackError
+from pedl_deploy.events import latest_event_id, wait_for_stack
+from pedl_deploy.timings import phase
+
+_lock = threading.Lock()
+_region_locks = {}
+
+
+def uses_shared_network(stack):
+    return any(parameter['ParameterKey'] == cloudformation.NETWORK_STACK_NAME_KEY
+               for parameter in stack.get('Parameters', []))
+
+
+def region_lock(boto3_session):
+    with _lock:
+        return _region_locks.setdefault(boto3_session.region_name, threading.Lock())
+
+
+def wait_for_network(stack_id, last_event_id, boto3_session):
+    cfn = client(boto3_session, 'cloudformation')
+    with phase(boto3_session.region_name, network.STACK_NAME, 'wait'):
+        wait_for_stack(network.STACK_NAME, stack_id, cfn, last_event_id)
+    invalidate_stack(network.STACK_NAME, boto3_session)
+
+
+def running_operation(boto3_session):
+    # The stack id and last event of a create or update of the network that another stack or run submitted,
+    # None when the network is not in progress
+    stack = describe_stack(network.STACK_NAME, boto3_session)
+    if stack is None or not stack['StackStatus'].endswith('_IN_PROGRESS'):
+        return None
+
+    last_event_id = latest_event_id(stack['StackId'], client(boto3_session, 'cloudformation'))
+    # The operation may have finished before that event, then there is nothing left to wait for
+    invalidate_stack(network.STACK_NAME, boto3_session)
+    stack = describe_stack(network.STACK_NAME, boto3_session)
+    if stack is None or not stack['StackStatus'].endswith('_IN_PROGRESS'):
+        return None
+
+    print(f'Waiting for {network.STACK_NAME} ({stack["StackStatus"]})')
+    return stack['StackId'], last_event_id
+
+
+def deploy_network(boto3_session, plan=False):
+    # Stacks of one region are deployed in parallel in batch mode, only the first one creates the network.
+    # The region lock is only held while submitting, so the stacks wait for the network side by side.
+    while True:
+        with region_lock(boto3_session):
+            running = running_operation(boto3_session)
+            if running is None:
+                pending = deploy_stack(network.STACK_NAME, read_template(resources.NETWORK), boto3_session,
+                                       plan=plan, wait=False)
+        if running is None:
+            break
+        try:
+            wait_for_network(*running, boto3_session)
+        except StackError:
+            # A failed update of another run rolls back to the previous network, which this stack can still use
+            invalidate_stack(network.STACK_NAME, boto3_session)
+            stack = describe_stack(network.STACK_NAME, boto3_session)
+            if stack is None or stack['StackStatus'] not in stack_status.USABLE_STATUSES:
+                raise
+
+    if pending:
+        wait_for_network(pending['stack_id'], pending['last_event_id'], boto3_session)
+
+
+def network_parameters(stack_name, boto3_session, plan=False):
+    # Stacks created with their own VPC keep it, moving them into the shared network would replace every resource
+    stack = describe_stack(stack_name, boto3_session)
+    if stack and not uses_shared_network(stack):
+        return None
+
+    deploy_network(boto3_session, plan)
+    return [cfn_parameter(cloudformation.NETWORK_STACK_NAME_KEY, network.STACK_NAME)]
@@ -0,0 +1,172 @@
+import argparse
+
+from pedl_deploy.constants import *
+from pedl_deploy.errors import ConfigError
+
+
+def non_negative_int(value):
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError(f'{value} is negative')
+    return number
+
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f'{value} is not positive')
+    return number
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description='Package for deploying PEDL to AWS')
+    parser.add_argument('--delete', action='store_true',
+                        help='Delete PEDL from account')
+    parser.add_argument('--delete-network', action='store_true',
+                        help='delete the network stack shared by the secure and vpc deployments of the region')
+    wait_group = parser.add_mutually_exclusive_group()
+    wait_group.add_argument('--no-wait', action='store_true',
+                            help='submit the deploy or delete and return without waiting for cloudformation')
+    wait_group.add_argument('--wait', action='store_true',
+                            help='resume waiting for operations submitted with --no-wait')
+    wait_group.add_argument('--wait-ready', action='store_true',
+                            help='after the deploy, wait until the master serves the UI and report how long it took')
+    parser.add_argument('--status', action='store_true',
+                        help='show the status, master address and running agents of the stack')
+    parser.add_argument('--all', action='store_true',
+                        help='with --status, show every pedl stack of the account, with --wait, wait for every '
+                             'submitted operation')
+    parser.add_argument('--json', action='store_true',
+                        help='with --status, print json instead of a table')
+    parser.add_argument('--plan', action='store_true',
+                        help='Show the changes a deployment would make without applying them')
+    parser.add_argument('--preflight-only', action='store_true',
+                        help='Only run the preflight checks against the account')
+    parser.add_argument('--deployment-type', type=str, default=defaults.DEPLOYMENT_TYPE,
+                        help=f'deployment type - must be one of [{", ".join(deployment_types.DEPLOYMENT_TYPES)}]')
+    parser.add_argument('--master-ami', type=str, default=None,
+                        help='ami for pedl master')
+    parser.add_argument('--agent-ami', type=str, default=None,
+                        help='ami for pedl agent')
+    parser.add_argument('--pedl-version', type=str, default=None,
+                        help='pedl version of the release amis, defaults to the latest release')
+    parser.add_argument('--keypair', type=str, default=defaults.KEYPAIR_NAME,
+                        help='keypair for master and agent')
+    parser.add_argument('--master-instance-type', type=str,
+                        default=defaults.MASTER_INSTANCE_TYPE,
+                        help='instance type for master')
+    parser.add_argument('--agent-instance-type', type=str,
+                        default=None,
+                        help=f'instance type for agent, or comma separated types in order of preference of which '
+                             f'the first offered in the region is used (default {defaults.AGENT_INSTANCE_TYPE})')
+    parser.add_argument('--min-agents', type=int,
+                        default=None,
+                        help=f'number of agent instances kept running as a warm pool '
+                             f'(default {master_config.DEFAULT_MIN_INSTANCES})')
+    parser.add_argument('--max-agents', type=int,
+                        default=None,
+                        help=f'maximum number of agent instances (default {master_config.DEFAULT_MAX_INSTANCES})')
+    parser.add_argument('--max-idle-agent-period', type=str,
+                        default=None,
+                        help=f'time an idle agent is kept before it is terminated, e.g. 30s, 10m or 1h '
+                             f'(default {master_config.DEFAULT_MAX_IDLE_AGENT_PERIOD})')
+    parser.add_argument('--agent-root-volume-size', type=int,
+                        default=None,
+                        help=f'agent root volume size in GiB (default {master_config.DEFAULT_ROOT_VOLUME_SIZE})')
+    parser.add_argument('--master-volume', type=str,
+                        default=None,
+                        help=f'root volume of the master as size=GiB,type=gp2|gp3|io1|io2,iops=N,throughput=MiB/s '
+                             f'(default size={volumes.DEFAULT_SIZE},type={volumes.DEFAULT_TYPE}), existing gp2 '
+                             f'masters are kept unless this is given')
+    parser.add_argument('--agent-volume', type=str,
+                        default=None,
+                        help=f'root volume of the agents in the format of --master-volume '
+                             f'(default type={volumes.DEFAULT_TYPE})')
+    parser.add_argument('--spot', action='store_true',
+                        default=None,
+                        help='launch the agents as spot instances, on-demand when the region has no spot market '
+                             'for the agent instance type')
+    parser.add_argument('--fast-snapshot-restore', action='store_true',
+                        default=None,
+                        help='enable fast snapshot restore on the snapshots of the agent ami in the agent zones, '
+                             'disabled again when the last stack using the ami is deleted')
+    parser.add_argument('--placement-group', action='store_true',
+                        default=None,
+                        help='launch the agents into a cluster placement group in a single subnet for faster '
+                             'networking between the agents of distributed trials, the agent instance type must '
+                             'support enhanced networking')
+    parser.add_argument('--agent-config', type=str,
+                        default=None,
+                        help='yaml file with the agent settings instance_type, min_instances, max_instances, '
+                             'max_idle_agent_period, root_volume_size, root_volume_type, root_volume_iops, '
+                             'root_volume_throughput, spot, fast_snapshot_restore and placement_group, overridden by '
+                             'the flags')
+    parser.add_argument('--save-experiment-best', type=non_negative_int,
+                        default=checkpoint_storage.DEFAULT_SAVE_EXPERIMENT_BEST,
+                        help='number of best checkpoints kept per experiment')
+    parser.add_argument('--save-trial-best', type=non_negative_int,
+                        default=checkpoint_storage.DEFAULT_SAVE_TRIAL_BEST,
+                        help='number of best checkpoints kept per trial')
+    parser.add_argument('--save-trial-latest', type=non_negative_int,
+                        default=checkpoint_storage.DEFAULT_SAVE_TRIAL_LATEST,
+                        help='number of latest checkpoints kept per trial')
+    parser.add_argument('--checkpoint-expiration-days', type=non_negative_int,
+                        default=checkpoint_storage.DEFAULT_EXPIRATION_DAYS,
+                        help='delete checkpoints from the bucket after this many days, 0 keeps them')
+    parser.add_argument('--abort-multipart-upload-days', type=non_negative_int,
+                        default=checkpoint_storage.DEFAULT_ABORT_MULTIPART_UPLOAD_DAYS,
+                        help='abort incomplete multipart uploads to the bucket after this many days, 0 keeps them')
+    parser.add_argument('--db-min-capacity', type=int, choices=database.CAPACITY_UNITS,
+                        default=None,
+                        help=f'minimum aurora capacity units of the serverless database '
+                             f'(default {database.DEFAULT_MIN_CAPACITY})')
+    parser.add_argument('--db-max-capacity', type=int, choices=database.CAPACITY_UNITS,
+                        default=None,
+                        help=f'maximum aurora capacity units of the serverless database '
+                             f'(default {database.DEFAULT_MAX_CAPACITY})')
+    parser.add_argument('--db-auto-pause', type=non_negative_int, metavar='SECONDS',
+                        default=None,
+                        help=f'pause the serverless database after this many idle seconds, 0 keeps it running '
+                             f'(default {database.DEFAULT_AUTO_PAUSE})')
+    parser.add_argument('--db-instance-class', type=str,
+                        default=None,
+                        help='run the database on a provisioned aurora instance of this class, e.g. db.r5.large, '
+                             'instead of aurora serverless')
+    parser.add_argument('--user', type=str,
+                        default=None,
+                        help='user to name stack and tag resources')
+    parser.add_argument('--users', type=str,
+                        default=None,
+                        help='comma separated users to deploy or delete in one batch')
+    parser.add_argument('--users-file', type=str,
+                        default=None,
+                        help='file with one user per line to deploy or delete in one batch')
+    parser.add_argument('--max-workers', type=positive_int,
+                        default=defaults.MAX_WORKERS,
+                        help='number of stacks processed concurrently in batch mode')
+    parser.add_argument('--regions', type=str,
+                        default=None,
+                        help='comma separated regions to deploy to in parallel, amis are copied from the '
+                             'session region')
+    parser.add_argument('--aws-profile', type=str,
+                        default=None,
+                        help='aws profile for deploying')
+    parser.add_argument('--timings', action='store_true',
+                        help='print the time spent in each phase and on each stack resource')
+    parser.add_argument('--timings-json', type=str,
+                        default=None,
+                        help='file to write the timings to as json')
+    parser.add_argument('--stats', action='store_true',
+                        help='print the number, latency, throttles and retries of the aws api calls')
+    return parser
+
+
+def deploy_options(**overrides):
+    # The options of the CLI with their defaults, for callers of the API
+    args = build_parser().parse_args([])
+    unknown = sorted(set(overrides) - set(vars(args)))
+    if unknown:
+        raise ConfigError(f'Unknown options {", ".join(unknown)}')
+    for name, value in overrides.items():
+        setattr(args, name, value)
+    return args
@@ -0,0 +1,139 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+from pedl_deploy.amis import get_index, match_release_amis
+from pedl_deploy.aws import describe_instance_type, describe_stack, get_caller_identity, has_spot_price, \
+    image_ena_support, instance_type_zones, keypair_exists, validate_template
+from pedl_deploy.constants import agent_scaling, defaults, preflight
+from pedl_deploy.deployment_types.base import read_template
+from pedl_deploy.errors import PEDLDeployError, PreflightError, TemplateError
+
+
+def check_identity(boto3_session):
+    return get_caller_identity(boto3_session)['Arn']
+
+
+def check_keypair(name, boto3_session):
+    if not keypair_exists(name, boto3_session):
+        raise PreflightError(f'Key pair {name} not found. Please create key pair first')
+    return name
+
+
+def check_amis(args, boto3_session):
+    if args.master_ami and args.agent_ami:
+        return args.master_ami, args.agent_ami
+
+    if args.aws_profile:
+        raise PreflightError('Profile must explicitly set ami ids')
+
+    try:
+        _, master_ami, agent_ami = match_release_amis(get_index(boto3_session, args.pedl_version),
+                                                            args.pedl_version)
+    except LookupError as e:
+        raise PreflightError(str(e)) from e
+    return master_ami, agent_ami
+
+
+def check_agents(instance_types, spot, zone, boto3_session):
+    # The first instance type offered in the zone the template pins the agents to is used, or in any zone of the
+    # region when they are not pinned. Spot capacity falls back to on-demand when the region has no spot market for
+    # that type.
+    offered = instance_type_zones(instance_types, boto3_session)
+    available = [instance_type for instance_type in instance_types
+                 if instance_type in offered and (zone is None or zone in offered[instance_type])]
+    if not available:
+        raise PreflightError(f'None of the agent instance types {", ".join(instance_types)} is offered in '
+                             f'{zone or boto3_session.region_name}')
+
+    instance_type = available[0]
+    if spot and has_spot_price(instance_type, agent_scaling.SPOT_PRODUCT, boto3_session):
+        return instance_type, agent_scaling.SPOT
+    return instance_type, agent_scaling.ON_DEMAND
+
+
+def check_placement(instance_type, agent_ami, boto3_session):
+    # A cluster placement group only pays off with enhanced networking, which needs both the instance type
+    # and the agent ami to support it
+    info = describe_instance_type(instance_type, boto3_session)
+    ena_support = info.get('NetworkInfo', {}).get('EnaSupport', agent_scaling.ENA_UNSUPPORTED)
+    if ena_support == agent_scaling.ENA_UNSUPPORTED:
+        raise PreflightError(f'The agent instance type {instance_type} does not support enhanced networking')
+    if agent_scaling.PLACEMENT_STRATEGY not in info.get('PlacementGroupInfo', {}).get('SupportedStrategies', []):
+        raise PreflightError(f'The agent instance type {instance_type} can not be launched into a cluster '
+                             f'placement group')
+    if image_ena_support(agent_ami, boto3_session) is False:
+        raise PreflightError(f'The agent ami {agent_ami} does not have enhanced networking enabled')
+    return f'{instance_type} enhanced networking {ena_support}'
+
+
+def check_template(template_name, boto3_session):
+    try:
+        validate_template(read_template(template_name), boto3_session)
+    except (ClientError, TemplateError) as e:
+        raise PreflightError(str(e)) from e
+    return template_name
+
+
+def check_stack(user, boto3_session):
+    stack_name = defaults.PEDL_STACK_NAME_BASE.format(user)
+    stack = describe_stack(stack_name, boto3_session)
+    if stack is None:
+        return f'{stack_name} not deployed'
+
+    status = stack['StackStatus']
+    if status.endswith('_IN_PROGRESS') or status in preflight.BLOCKED_STACK_STATUSES:
+        raise PreflightError(f'{stack_name} is in state {status} and can not be updated')
+    return f'{stack_name} {status}'
+
+
+def format_result(name, future):
+    try:
+        result = future.result()
+    except (PEDLDeployError, ClientError, BotoCoreError) as e:
+        return False, f'  {name:<{preflight.NAME_WIDTH}} FAILED  {e}'
+    if isinstance(result, tuple):
+        result = ', '.join(result)
+    return True, f'  {name:<{preflight.NAME_WIDTH}} ok      {result}'
+
+
+def run_preflight(args, boto3_session, deployment, batch=False):
+    # The checks are independent, so they all run at once and every failure is reported together. A batch checks the
+    # state of every stack in the task of that stack, so one blocked stack fails on its own instead of the whole batch.
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=preflight.MAX_WORKERS) as executor:
+        checks = {
+            'identity': executor.submit(check_identity, boto3_session),
+            'keypair': executor.submit(check_keypair, args.keypair, boto3_session),
+            'amis': executor.submit(check_amis, args, boto3_session),
+            'agents': executor.submit(lambda: check_agents(args.agent_instance_type, args.spot,
+                                                           deployment.pinned_agent_zone(boto3_session),
+                                                           boto3_session)),
+            'template': executor.submit(check_template, deployment.template_name, boto3_session),
+        }
+
+        if not batch:
+            # The stack name needs the user, which may come from the identity check
+            identity = checks['identity']
+            checks['stack'] = executor.submit(
+                lambda: check_stack(args.user or identity.result().split('/')[-1], boto3_session))
+
+        if args.placement_group:
+            amis, agents = checks['amis'], checks['agents']
+            checks['placement'] = executor.submit(
+                lambda: check_placement(agents.result()[0], amis.result()[1], boto3_session))
+
+        results = [format_result(name, future) for name, future in checks.items()]
+
+    print('Preflight checks')
+    for _, line in results:
+        print(line)
+    print(f'Preflight finished in {time.time() - start:.1f}s')
+
+    failed = sum(1 for ok, _ in results if not ok)
+    if failed:
+        raise PreflightError(f'{failed} of {len(results)} preflight checks failed')
+
+    master_ami, agent_ami = checks['amis'].result()
+    return master_ami, agent_ami, checks['agents'].result()
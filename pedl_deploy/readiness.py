@@ -0,0 +1,29 @@
+import http.client
+import time
+import urllib.error
+import urllib.request
+
+from pedl_deploy.constants import readiness
+
+
+def is_serving(url):
+    # Any answer counts, an error page from the master still means it serves requests
+    try:
+        urllib.request.urlopen(url, timeout=readiness.REQUEST_TIMEOUT).close()
+    except urllib.error.HTTPError as e:
+        return e.code < 500
+    except (OSError, http.client.HTTPException):
+        return False
+    return True
+
+
+def wait_until_serving(url, timeout=readiness.TIMEOUT):
+    # The master starts after the stack is complete, so the first polls come fast and back off from there
+    deadline = time.time() + timeout
+    delay = readiness.MIN_DELAY
+    while not is_serving(url):
+        if time.time() + delay > deadline:
+            return False
+        time.sleep(delay)
+        delay = min(delay * readiness.BACKOFF, readiness.MAX_DELAY)
+    return True
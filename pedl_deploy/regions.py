@@ -0,0 +1,126 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pedl_deploy.clients import client
+from pedl_deploy.constants import ami_replication
+from pedl_deploy.errors import AmiError, PreflightError
+from pedl_deploy.preflight import check_agents, check_keypair, check_stack, format_result
+
+
+def find_copy(source_ami, boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+
+    images = ec2.describe_images(
+        Filters=[
+            {
+                'Name': f'tag:{ami_replication.SOURCE_TAG}',
+                'Values': [
+                    source_ami,
+                ]
+            },
+        ],
+        Owners=['self']
+    )['Images']
+    images = [image for image in images if image['State'] in ('available', 'pending')]
+    if images:
+        return images[0]['ImageId']
+    return None
+
+
+def copy_ami(source_ami, source_session, boto3_session):
+    # Copies made by earlier runs are tagged with their source AMI and reused
+    image_id = find_copy(source_ami, boto3_session)
+    if image_id:
+        return image_id
+
+    source = client(source_session, 'ec2').describe_images(ImageIds=[source_ami])['Images'][0]
+    ec2 = client(boto3_session, 'ec2')
+    # The source tag comes with the copy, so a run interrupted right after copy_image still finds it
+    image_id = ec2.copy_image(
+        Name=source['Name'],
+        SourceImageId=source_ami,
+        SourceRegion=source_session.region_name,
+        CopyImageTags=True,
+        TagSpecifications=[
+            {
+                'ResourceType': 'image',
+                'Tags': [
+                    {
+                        'Key': ami_replication.SOURCE_TAG,
+                        'Value': source_ami
+                    }
+                ]
+            }
+        ]
+    )['ImageId']
+    print(f'Copying {source_ami} to {boto3_session.region_name} as {image_id}')
+    return image_id
+
+
+def wait_for_copies(copies, sessions):
+    # One progress line covers the copies of every region
+    pending = {region: list(amis) for region, amis in copies.items()}
+    while True:
+        progress = []
+        for region, amis in copies.items():
+            images = client(sessions[region], 'ec2').describe_images(ImageIds=list(amis))['Images']
+            states = {image['ImageId']: image['State'] for image in images}
+            failed = [ami for ami in amis if states.get(ami) in ('failed', 'invalid', 'error')]
+            if failed:
+                raise AmiError(f'Copying AMIs to {region} failed: {", ".join(failed)}')
+
+            pending[region] = [ami for ami in amis if states.get(ami) != 'available']
+            progress.append(f'{region} {len(amis) - len(pending[region])}/{len(amis)}')
+
+        print(f'AMIs available: {", ".join(progress)}')
+        if not any(pending.values()):
+            return
+        time.sleep(ami_replication.POLL_DELAY)
+
+
+def replicate_amis(master_ami, agent_ami, source_session, sessions):
+    targets = [region for region in sessions if region != source_session.region_name]
+    copies = {source_session.region_name: (master_ami, agent_ami)}
+    if not targets:
+        return copies
+
+    with ThreadPoolExecutor(max_workers=2 * len(targets)) as executor:
+        futures = {region: (executor.submit(copy_ami, master_ami, source_session, sessions[region]),
+                            executor.submit(copy_ami, agent_ami, source_session, sessions[region]))
+                   for region in targets}
+        for region, (master_future, agent_future) in futures.items():
+            copies[region] = (master_future.result(), agent_future.result())
+
+    wait_for_copies({region: copies[region] for region in targets}, sessions)
+    return copies
+
+
+def check_regions(args, user, deployment, sessions):
+    # The regions differ in keypairs, offered instance types and stacks, so those checks run in every region.
+    # Returns the agent instance type and market picked in each region.
+    with ThreadPoolExecutor(max_workers=3 * len(sessions)) as executor:
+        checks = {}
+        for region, boto3_session in sessions.items():
+            checks[f'keypair {region}'] = executor.submit(check_keypair, args.keypair, boto3_session)
+            checks[f'agents {region}'] = executor.submit(
+                lambda session: check_agents(args.agent_instance_type, args.spot,
+                                             deployment.pinned_agent_zone(session), session), boto3_session)
+            checks[f'stack {region}'] = executor.submit(check_stack, user, boto3_session)
+        results = [format_result(name, future) for name, future in checks.items()]
+
+    for _, line in results:
+        print(line)
+    failed = sum(1 for ok, _ in results if not ok)
+    if failed:
+        raise PreflightError(f'{failed} of {len(results)} region checks failed')
+    return {region: checks[f'agents {region}'].result() for region in sessions}
+
+
+def print_endpoints(results, endpoints):
+    print()
+    print(f'{"Region":<16} {"Status":<8} PEDL UI')
+    for region, error in results.items():
+        if error is None:
+            print(f'{region:<16} {"ok":<8} {endpoints.get(region, "")}')
+        else:
+            print(f'{region:<16} {"FAILED":<8} {error}')
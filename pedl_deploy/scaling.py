@@ -0,0 +1,75 @@
+import re
+
+import yaml
+
+from pedl_deploy.constants import agent_scaling, defaults, master_config, volumes
+from pedl_deploy.volumes import parse_volume, volume_settings
+
+
+def read_agent_config(path):
+    with open(path) as f:
+        config = yaml.safe_load(f) or {}
+    if not isinstance(config, dict):
+        raise ValueError(f'{path} must contain a mapping of agent settings')
+
+    unknown = sorted(set(config) - set(agent_scaling.CONFIG_KEYS))
+    if unknown:
+        raise ValueError(f'Unknown agent settings in {path}: {", ".join(unknown)}')
+    return config
+
+
+def instance_types(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return [instance_type.strip() for instance_type in value if instance_type.strip()]
+
+
+def apply_agent_config(args):
+    # Flags override the --agent-config file, which overrides the defaults of master_config
+    config = read_agent_config(args.agent_config) if args.agent_config else {}
+
+    def setting(value, key, default):
+        if value is not None:
+            return value
+        return config.get(key, default)
+
+    def switch(value, key):
+        # A quoted 'false' in the file would otherwise turn the setting on
+        value = setting(value, key, False)
+        if not isinstance(value, bool):
+            raise ValueError(f'Invalid value {value!r} for {key}, expected true or false')
+        return value
+
+    args.agent_instance_type = instance_types(
+        setting(args.agent_instance_type, master_config.INSTANCE_TYPE, defaults.AGENT_INSTANCE_TYPE))
+    args.min_agents = int(setting(args.min_agents, master_config.MIN_INSTANCES,
+                                  master_config.DEFAULT_MIN_INSTANCES))
+    args.max_agents = int(setting(args.max_agents, master_config.MAX_INSTANCES,
+                                  master_config.DEFAULT_MAX_INSTANCES))
+    args.max_idle_agent_period = str(setting(args.max_idle_agent_period, master_config.MAX_IDLE_AGENT_PERIOD,
+                                             master_config.DEFAULT_MAX_IDLE_AGENT_PERIOD))
+    agent_root_volume_size = setting(args.agent_root_volume_size, master_config.ROOT_VOLUME_SIZE,
+                                     master_config.DEFAULT_ROOT_VOLUME_SIZE)
+    args.spot = switch(args.spot, master_config.SPOT)
+    args.fast_snapshot_restore = switch(args.fast_snapshot_restore, agent_scaling.FAST_SNAPSHOT_RESTORE)
+    args.placement_group = switch(args.placement_group, agent_scaling.PLACEMENT_GROUP)
+
+    if not args.agent_instance_type:
+        raise ValueError('At least one agent instance type is required')
+    if args.min_agents < 0:
+        raise ValueError('The minimum number of agents can not be negative')
+    if args.max_agents < args.min_agents:
+        raise ValueError(f'The maximum number of agents {args.max_agents} is below the minimum {args.min_agents}')
+    if not re.match(agent_scaling.IDLE_PERIOD_PATTERN, args.max_idle_agent_period):
+        raise ValueError(f'Invalid idle agent period {args.max_idle_agent_period}, expected e.g. 30s, 10m or 1h')
+
+    # --agent-volume overrides the root volume settings of the file
+    agent_volume = {
+        volumes.TYPE: config.get(master_config.ROOT_VOLUME_TYPE),
+        volumes.IOPS: config.get(master_config.ROOT_VOLUME_IOPS),
+        volumes.THROUGHPUT: config.get(master_config.ROOT_VOLUME_THROUGHPUT)
+    }
+    agent_volume.update(parse_volume(args.agent_volume) if args.agent_volume else {})
+    args.agent_volume = volume_settings(agent_volume, agent_root_volume_size)
+    args.master_volume = volume_settings(parse_volume(args.master_volume), volumes.DEFAULT_SIZE) \
+        if args.master_volume else None
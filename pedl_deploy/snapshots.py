@@ -0,0 +1,109 @@
+import threading
+
+from pedl_deploy.clients import client
+from pedl_deploy.constants import cloudformation, fast_snapshot_restore
+from pedl_deploy.status import list_pedl_stacks, stack_parameters
+
+
+class StackUsage:
+    # Which other stacks of the region launch agents from an AMI. The stacks are listed at most once for all the
+    # stacks deleted together, which do not count as users of their AMIs.
+    def __init__(self, stack_names, boto3_session):
+        self._stack_names = set(stack_names)
+        self._boto3_session = boto3_session
+        self._lock = threading.Lock()
+        self._stacks = None
+
+    def users(self, image_id):
+        with self._lock:
+            if self._stacks is None:
+                self._stacks = [stack for stack in list_pedl_stacks(self._boto3_session)
+                                if stack['StackName'] not in self._stack_names and
+                                not stack['StackStatus'].startswith('DELETE')]
+        return [stack['StackName'] for stack in self._stacks
+                if stack_parameters(stack).get(cloudformation.AGENT_AMI_KEY) == image_id]
+
+
+def image_snapshots(image_id, boto3_session):
+    # Snapshots owned by the account and those shared with it can both be restored fast, failures for others are
+    # reported per snapshot and zone
+    images = client(boto3_session, 'ec2').describe_images(ImageIds=[image_id])['Images']
+    if not images:
+        return []
+    return [mapping['Ebs']['SnapshotId'] for mapping in images[0].get('BlockDeviceMappings', [])
+            if mapping.get('Ebs', {}).get('SnapshotId')]
+
+
+def active_restores(snapshot_ids, boto3_session):
+    paginator = client(boto3_session, 'ec2').get_paginator('describe_fast_snapshot_restores')
+    restores = set()
+    filters = [
+        {
+            'Name': 'snapshot-id',
+            'Values': snapshot_ids
+        },
+        {
+            'Name': 'state',
+            'Values': fast_snapshot_restore.ACTIVE_STATES
+        }
+    ]
+    for page in paginator.paginate(Filters=filters):
+        restores.update((restore['SnapshotId'], restore['AvailabilityZone'])
+                        for restore in page['FastSnapshotRestores'])
+    return restores
+
+
+def print_response(response, action):
+    # The call succeeds even when every snapshot and zone failed, those only show up as Unsuccessful entries
+    for item in response.get('Unsuccessful', []):
+        for error in item.get('FastSnapshotRestoreStateErrors', []):
+            print(f'{action} fast snapshot restore of {item["SnapshotId"]} in {error["AvailabilityZone"]} failed: '
+                  f'{error["Error"]["Message"]}')
+
+    succeeded = response.get('Successful', [])
+    if succeeded:
+        snapshot_ids = sorted({item['SnapshotId'] for item in succeeded})
+        zones = sorted({item['AvailabilityZone'] for item in succeeded})
+        print(f'{action} fast snapshot restore of {", ".join(snapshot_ids)} in {", ".join(zones)}')
+
+
+def enable_fast_snapshot_restore(image_id, zones, boto3_session):
+    snapshot_ids = image_snapshots(image_id, boto3_session)
+    if not snapshot_ids:
+        print(f'Skipping fast snapshot restore, the agent AMI {image_id} has no EBS snapshots')
+        return
+
+    active = active_restores(snapshot_ids, boto3_session)
+    zones = [zone for zone in zones if any((snapshot_id, zone) not in active for snapshot_id in snapshot_ids)]
+    if not zones:
+        return
+
+    response = client(boto3_session, 'ec2').enable_fast_snapshot_restores(
+        AvailabilityZones=zones,
+        SourceSnapshotIds=snapshot_ids
+    )
+    print_response(response, 'Enabling')
+
+
+def disable_fast_snapshot_restore(image_id, usage, boto3_session):
+    # Only AMIs with active restores need the stacks of the region, which are listed once per usage
+    snapshot_ids = image_snapshots(image_id, boto3_session)
+    if not snapshot_ids:
+        return
+
+    active = active_restores(snapshot_ids, boto3_session)
+    if not active:
+        return
+
+    # Other stacks of the region launching agents from the same AMI still profit from the restore
+    users = usage.users(image_id)
+    if users:
+        print(f'Keeping fast snapshot restore of {image_id}, it is used by {users[0]}')
+        return
+
+    zones = sorted({zone for _, zone in active})
+    response = client(boto3_session, 'ec2').disable_fast_snapshot_restores(
+        AvailabilityZones=zones,
+        SourceSnapshotIds=snapshot_ids
+    )
+    print_response(response, 'Disabling')
@@ -0,0 +1,43 @@
+import json
+import os
+
+from pedl_deploy.constants import misc
+
+
+def state_path(stack_name, region):
+    return os.path.join(os.path.expanduser(misc.STATE_DIR), f'{stack_name}-{region}.json')
+
+
+def save_state(state):
+    path = state_path(state['stack_name'], state['region'])
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def clear_state(state):
+    try:
+        os.remove(state_path(state['stack_name'], state['region']))
+    except FileNotFoundError:
+        pass
+
+
+def load_states(stack_names=None):
+    state_dir = os.path.expanduser(misc.STATE_DIR)
+    if not os.path.isdir(state_dir):
+        return []
+
+    states = []
+    for name in sorted(os.listdir(state_dir)):
+        if not name.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(state_dir, name)) as f:
+                state = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if stack_names is None or state['stack_name'] in stack_names:
+            states.append(state)
+    return states
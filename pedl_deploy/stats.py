@@ -0,0 +1,95 @@
+import threading
+import time
+
+from botocore import xform_name
+
+from pedl_deploy.clients import register_handler
+from pedl_deploy.constants import api_stats
+
+_lock = threading.Lock()
+_operations = {}
+_installed = False
+
+
+def operation_name(model):
+    return f'{model.service_model.service_name}.{xform_name(model.name)}'
+
+
+def _record(name, **values):
+    with _lock:
+        operation = _operations.setdefault(name, {
+            'calls': 0,
+            'errors': 0,
+            'throttles': 0,
+            'retries': 0,
+            'seconds': 0.0,
+            'max_seconds': 0.0
+        })
+        for key, value in values.items():
+            if key == 'max_seconds':
+                operation[key] = max(operation[key], value)
+            else:
+                operation[key] += value
+
+
+def before_call(context, **kwargs):
+    context['pedl_start'] = time.perf_counter()
+
+
+def after_call(model, parsed, context, **kwargs):
+    seconds = time.perf_counter() - context.get('pedl_start', time.perf_counter())
+    _record(operation_name(model),
+            calls=1,
+            errors=1 if 'Error' in parsed else 0,
+            retries=parsed.get('ResponseMetadata', {}).get('RetryAttempts', 0),
+            seconds=seconds,
+            max_seconds=seconds)
+
+
+def after_call_error(event_name, context, **kwargs):
+    # Raised when the request itself failed, e.g. the connection broke on the last attempt
+    seconds = time.perf_counter() - context.get('pedl_start', time.perf_counter())
+    _, service, operation = event_name.split('.', 2)
+    _record(f'{service}.{xform_name(operation)}', calls=1, errors=1, seconds=seconds, max_seconds=seconds)
+
+
+def needs_retry(operation, response=None, **kwargs):
+    # Runs once per attempt, next to the retry handler of botocore that feeds the adaptive rate limiter
+    if response is None:
+        return
+    code = response[1].get('Error', {}).get('Code')
+    if code in api_stats.THROTTLE_ERROR_CODES:
+        _record(operation_name(operation), throttles=1)
+
+
+def install():
+    global _installed
+    with _lock:
+        if _installed:
+            return
+        _installed = True
+
+    register_handler('before-call', before_call)
+    register_handler('after-call', after_call)
+    register_handler('after-call-error', after_call_error)
+    register_handler('needs-retry', needs_retry)
+
+
+def report():
+    with _lock:
+        return {name: dict(values) for name, values in sorted(_operations.items())}
+
+
+def print_summary():
+    operations = report()
+    print()
+    print(f'{"AWS API calls":<{api_stats.OPERATION_WIDTH}} {"calls":>6} {"errors":>6} {"throttled":>9} '
+          f'{"retries":>7} {"avg ms":>8} {"max ms":>8}')
+    for name, values in operations.items():
+        average = values['seconds'] / values['calls'] * 1000 if values['calls'] else 0
+        print(f'{name:<{api_stats.OPERATION_WIDTH}} {values["calls"]:>6} {values["errors"]:>6} '
+              f'{values["throttles"]:>9} {values["retries"]:>7} {average:>8.1f} {values["max_seconds"] * 1000:>8.1f}')
+
+    total = sum(values['calls'] for values in operations.values())
+    throttles = sum(values['throttles'] for values in operations.values())
+    print(f'{total} calls, {throttles} throttled')
@@ -0,0 +1,132 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+from pedl_deploy.aws import describe_instances, describe_stack
+from pedl_deploy.clients import client
+from pedl_deploy.constants import cloudformation, defaults, deployment_types, fleet_status, network
+
+
+def list_pedl_stacks(boto3_session):
+    # describe_stacks without a name pages through every stack and includes the outputs, which list_stacks does not
+    prefix = defaults.PEDL_STACK_NAME_BASE.format('')
+    paginator = client(boto3_session, 'cloudformation').get_paginator('describe_stacks')
+    stacks = []
+    for page in paginator.paginate():
+        stacks.extend(stack for stack in page['Stacks']
+                      if stack['StackName'].startswith(prefix) and stack['StackName'] != network.STACK_NAME)
+    return stacks
+
+
+def stack_parameters(stack):
+    return {parameter['ParameterKey']: parameter.get('ParameterValue') for parameter in stack.get('Parameters', [])}
+
+
+def stack_outputs(stack):
+    return {output['OutputKey']: output['OutputValue'] for output in stack.get('Outputs', [])}
+
+
+def stack_user(stack):
+    prefix = defaults.PEDL_STACK_NAME_BASE.format('')
+    return stack_parameters(stack).get(cloudformation.USER_NAME_KEY) or stack['StackName'][len(prefix):]
+
+
+def deployment_type(stack):
+    outputs = stack_outputs(stack)
+    if cloudformation.BASTION_ID in outputs:
+        return deployment_types.SECURE
+    if cloudformation.VPC_KEY in outputs:
+        return deployment_types.VPC
+    return deployment_types.SIMPLE
+
+
+def chunks(values):
+    return [values[i:i + fleet_status.MAX_FILTER_VALUES]
+            for i in range(0, len(values), fleet_status.MAX_FILTER_VALUES)]
+
+
+def lookup_instances(instance_ids, boto3_session):
+    instances = {}
+    for ids in chunks(instance_ids):
+        for instance in describe_instances([{'Name': 'instance-id', 'Values': ids}], boto3_session):
+            instances[instance['InstanceId']] = instance
+    return instances
+
+
+def count_agents(users, boto3_session):
+    tag_keys = [fleet_status.AGENT_TAG_KEY.format(user) for user in users]
+    counts = {tag_key: 0 for tag_key in tag_keys}
+    for keys in chunks(tag_keys):
+        filters = [
+            {'Name': 'tag-key', 'Values': keys},
+            {'Name': 'instance-state-name', 'Values': fleet_status.AGENT_STATES}
+        ]
+        for instance in describe_instances(filters, boto3_session):
+            for tag in instance.get('Tags', []):
+                if tag['Key'] in counts:
+                    counts[tag['Key']] += 1
+    return {user: counts[fleet_status.AGENT_TAG_KEY.format(user)] for user in users}
+
+
+def collect_status(stacks, boto3_session):
+    outputs = {stack['StackName']: stack_outputs(stack) for stack in stacks}
+    instance_ids = sorted({output[key] for output in outputs.values()
+                           for key in (cloudformation.MASTER_ID, cloudformation.BASTION_ID) if key in output})
+    users = [stack_user(stack) for stack in stacks]
+
+    # The master and bastion lookup and the agent count are independent
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        instances = executor.submit(lookup_instances, instance_ids, boto3_session)
+        agents = executor.submit(count_agents, users, boto3_session)
+        instances, agents = instances.result(), agents.result()
+
+    rows = []
+    for stack, user in zip(stacks, users):
+        output = outputs[stack['StackName']]
+        master = instances.get(output.get(cloudformation.MASTER_ID), {})
+        bastion = instances.get(output.get(cloudformation.BASTION_ID), {})
+        kind = deployment_type(stack)
+        row = {
+            'stack': stack['StackName'],
+            'user': user,
+            'status': stack['StackStatus'],
+            'type': kind,
+            'master': master.get('State', {}).get('Name'),
+            'master_ip': master.get(cloudformation.PRIVATE_IP_ADDRESS if kind == deployment_types.SECURE
+                                    else cloudformation.PUBLIC_IP_ADDRESS),
+            'bastion_ip': bastion.get(cloudformation.PUBLIC_IP_ADDRESS),
+            'agents': agents[user]
+        }
+        # The secure master is only reachable through a tunnel over the bastion
+        row['ui'] = f'http://{row["master_ip"]}:8080' \
+            if row['master_ip'] and kind != deployment_types.SECURE else None
+        rows.append(row)
+    return rows
+
+
+def get_stacks(boto3_session, users=None):
+    # Only --all pages through every stack of the account, the stacks of explicit users are described by name
+    if users is None:
+        return list_pedl_stacks(boto3_session)
+
+    names = [defaults.PEDL_STACK_NAME_BASE.format(user) for user in users]
+    with ThreadPoolExecutor(max_workers=fleet_status.MAX_WORKERS) as executor:
+        stacks = list(executor.map(lambda name: describe_stack(name, boto3_session, quiet=True), names))
+    return [stack for stack in stacks if stack is not None]
+
+
+def print_status(rows, as_json=False):
+    if as_json:
+        print(json.dumps(rows, indent=2))
+        return
+
+    if not rows:
+        print('No PEDL stacks found')
+        return
+
+    width = max(len(row['stack']) for row in rows)
+    status_width = max(len(row['status']) for row in rows)
+    print(f'{"Stack":<{width}} {"Status":<{status_width}} {"Type":<6} {"Master":<10} {"Master IP":<15} '
+          f'{"Bastion IP":<15} Agents')
+    for row in rows:
+        print(f'{row["stack"]:<{width}} {row["status"]:<{status_width}} {row["type"]:<6} {row["master"] or "-":<10} '
+              f'{row["master_ip"] or "-":<15} {row["bastion_ip"] or "-":<15} {row["agents"]}')
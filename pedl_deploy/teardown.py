@@ -0,0 +1,57 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from pedl_deploy.aws import describe_instances
+from pedl_deploy.clients import client
+from pedl_deploy.constants import fleet_status, teardown
+
+
+def find_agents(user, boto3_session):
+    # The provisioner of the master launches the agents outside of the stack and tags them with the user
+    return describe_instances([
+        {
+            'Name': f'tag:{fleet_status.AGENT_TAG_KEY.format(user)}',
+            'Values': [teardown.AGENT_TAG_VALUE.format(user)]
+        },
+        {
+            'Name': 'instance-state-name',
+            'Values': teardown.LIVE_STATES
+        }
+    ], boto3_session)
+
+
+def terminate_instances(instance_ids, boto3_session):
+    ec2 = client(boto3_session, 'ec2')
+    batches = [instance_ids[i:i + teardown.TERMINATE_BATCH_SIZE]
+               for i in range(0, len(instance_ids), teardown.TERMINATE_BATCH_SIZE)]
+    if not batches:
+        return
+
+    with ThreadPoolExecutor(max_workers=min(len(batches), teardown.MAX_WORKERS)) as executor:
+        futures = [executor.submit(ec2.terminate_instances, InstanceIds=batch) for batch in batches]
+        for future in futures:
+            future.result()
+
+
+def terminate_agents(user, boto3_session, agents=None):
+    if agents is None:
+        agents = find_agents(user, boto3_session)
+    instance_ids = [agent['InstanceId'] for agent in agents
+                    if agent['State']['Name'] in teardown.TERMINABLE_STATES]
+    if instance_ids:
+        print(f'Terminating {len(instance_ids)} agents of {user}')
+        terminate_instances(instance_ids, boto3_session)
+    return instance_ids
+
+
+def drain_agents(user, boto3_session, stop):
+    # Agents the master launched while the first batch was terminated are terminated as they show up,
+    # until none is left to hold on to the agent security group and instance profile. The delete sets stop
+    # once the stack is gone or has failed, the deadline covers a delete that never returns.
+    deadline = time.time() + teardown.DRAIN_TIMEOUT
+    while not stop.is_set() and time.time() < deadline:
+        agents = find_agents(user, boto3_session)
+        if not agents:
+            return
+        terminate_agents(user, boto3_session, agents)
+        stop.wait(teardown.POLL_DELAY)
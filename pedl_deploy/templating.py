@@ -0,0 +1,337 @@
+import copy
+import functools
+import hashlib
+import importlib.resources
+import os
+import re
+import textwrap
+
+import yaml
+
+from pedl_deploy.constants import misc, templating
+from pedl_deploy.errors import TemplateError
+
+SUB_VARIABLE = re.compile(r'\$\{([^!}][^}]*)\}')
+# A line of text holding only {{Name}}, e.g. in the UserData of the master
+TEXT_VARIABLE = re.compile(r'^([ \t]*)\{\{(\w+)\}\}(\n?)', re.MULTILINE)
+
+
+class Function:
+    # A CloudFormation function in short form like !Ref or !Sub, kept as written so the rendered template reads
+    # like the hand written one
+    def __init__(self, tag, value):
+        self.tag = tag
+        self.value = value
+
+    def __eq__(self, other):
+        return isinstance(other, Function) and (self.tag, self.value) == (other.tag, other.value)
+
+    def __repr__(self):
+        return f'{self.tag} {self.value!r}'
+
+
+class Variable:
+    # !Var in a component, replaced by the value the layout gives the variable
+    def __init__(self, name):
+        self.name = name
+
+    def __eq__(self, other):
+        return isinstance(other, Variable) and self.name == other.name
+
+    def __repr__(self):
+        return f'!Var {self.name}'
+
+
+class TemplateLoader(yaml.SafeLoader):
+    pass
+
+
+def construct_function(loader, tag_suffix, node):
+    if isinstance(node, yaml.ScalarNode):
+        value = loader.construct_scalar(node)
+    elif isinstance(node, yaml.SequenceNode):
+        value = loader.construct_sequence(node, deep=True)
+    else:
+        value = loader.construct_mapping(node, deep=True)
+
+    if tag_suffix == 'Var':
+        return Variable(value)
+    return Function(f'!{tag_suffix}', value)
+
+
+TemplateLoader.add_multi_constructor('!', construct_function)
+
+
+class TemplateDumper(yaml.SafeDumper):
+    def ignore_aliases(self, data):
+        return True
+
+    def increase_indent(self, flow=False, indentless=False):
+        # Indent lists under their key like the hand written templates
+        return super().increase_indent(flow, False)
+
+    def choose_scalar_style(self):
+        # PyYAML quotes every tagged scalar, the functions read better plain, e.g. !Ref UserName
+        style = super().choose_scalar_style()
+        if style != "'" or self.event.style or not self.event.tag.startswith('!') or self.analysis.empty:
+            return style
+        plain = self.analysis.allow_flow_plain if self.flow_level else self.analysis.allow_block_plain
+        return '' if plain else style
+
+
+def represent_str(dumper, data):
+    if '\n' in data:
+        return dumper.represent_scalar('tag:yaml.org,2002:str', data, style='|')
+    return dumper.represent_str(data)
+
+
+def represent_function(dumper, data):
+    if isinstance(data.value, str):
+        return dumper.represent_scalar(data.tag, data.value, style='|' if '\n' in data.value else None)
+    if isinstance(data.value, list):
+        # Short argument lists like !If [Condition, a, b] stay on one line
+        flow = all(isinstance(item, (str, int, bool)) and '\n' not in str(item) for item in data.value)
+        return dumper.represent_sequence(data.tag, data.value, flow_style=flow)
+    return dumper.represent_mapping(data.tag, data.value)
+
+
+TemplateDumper.add_representer(str, represent_str)
+TemplateDumper.add_representer(Function, represent_function)
+
+
+def load_yaml(text):
+    return yaml.load(text, Loader=TemplateLoader)
+
+
+def dump_yaml(node):
+    return yaml.dump(node, Dumper=TemplateDumper, sort_keys=False, default_flow_style=False, width=4096)
+
+
+def dump_template(template):
+    # One entry at a time, so the entries of a section are separated by blank lines
+    sections = []
+    for section, entries in template.items():
+        if not isinstance(entries, dict):
+            sections.append(dump_yaml({section: entries}))
+            continue
+        body = '\n'.join(textwrap.indent(dump_yaml({key: value}), '  ') for key, value in entries.items())
+        sections.append(f'{section}:\n{body}')
+    return '\n'.join(sections)
+
+
+def read_resource(name):
+    return importlib.resources.files(misc.TEMPLATE_PATH).joinpath(name).read_text()
+
+
+def template_hash(template_body):
+    return hashlib.sha256(template_body.encode()).hexdigest()
+
+
+def merge_entries(template, sources, part, source):
+    # Components may declare the same entry, e.g. a parameter several of them use, as long as they agree on it
+    for section, entries in part.items():
+        if section not in templating.MERGED_SECTIONS:
+            raise TemplateError(f'{source}: unexpected section {section}')
+
+        merged = template.setdefault(section, {})
+        for key, value in (entries or {}).items():
+            if key in merged and merged[key] != value:
+                raise TemplateError(f'{source}: {section} {key} conflicts with {sources[(section, key)]}')
+            if key not in merged:
+                merged[key] = value
+                sources[(section, key)] = source
+
+
+def substitute(node, variables, used):
+    # Entries set to a variable without a value are left out, like AWS::NoValue
+    if isinstance(node, Variable):
+        if node.name not in variables:
+            raise TemplateError(f'Variable {node.name} is not defined')
+        used.add(node.name)
+        return copy.deepcopy(variables[node.name])
+    if isinstance(node, dict):
+        return {key: substitute(value, variables, used) for key, value in node.items()
+                if not is_unset(value, variables, used)}
+    if isinstance(node, list):
+        items = []
+        for item in node:
+            if is_unset(item, variables, used):
+                continue
+            value = substitute(item, variables, used)
+            # A variable holding a list adds its items, e.g. policies only some layouts give a role
+            if isinstance(item, Variable) and isinstance(value, list):
+                items.extend(value)
+            else:
+                items.append(value)
+        return items
+    if isinstance(node, Function):
+        return Function(node.tag, substitute(node.value, variables, used))
+    if isinstance(node, str):
+        return substitute_text(node, variables, used)
+    return node
+
+
+def substitute_text(text, variables, used):
+    # The {{Name}} line is replaced by the lines of the variable, indented like it, and left out without a value
+    def replace(match):
+        indent, name, end = match.groups()
+        if name not in variables:
+            raise TemplateError(f'Variable {name} is not defined')
+        used.add(name)
+        value = variables[name]
+        if value is None:
+            return ''
+        if not isinstance(value, str):
+            raise TemplateError(f'Variable {name} is used in text but is not text')
+        lines = value[:-1] if value.endswith('\n') else value
+        return '\n'.join(indent + line if line else line for line in lines.split('\n')) + end
+
+    return TEXT_VARIABLE.sub(replace, text)
+
+
+def is_unset(node, variables, used):
+    if isinstance(node, Variable) and node.name in variables and variables[node.name] is None:
+        used.add(node.name)
+        return True
+    return False
+
+
+def compose(layout, template_name):
+    variables = layout.pop(templating.VARIABLES_KEY, None) or {}
+    parts = [(templating.COMPONENT_PATH.format(name), load_yaml(read_resource(templating.COMPONENT_PATH.format(name))))
+             for name in layout.pop(templating.COMPONENTS_KEY)]
+    parts.append((template_name, {section: entries for section, entries in layout.items()
+                                  if section in templating.MERGED_SECTIONS}))
+
+    merged = {}
+    sources = {}
+    for source, part in parts:
+        merge_entries(merged, sources, part or {}, source)
+
+    used = set()
+    try:
+        merged = substitute(merged, variables, used)
+    except TemplateError as e:
+        raise TemplateError(f'{template_name}: {e}') from e
+    unused = sorted(set(variables) - used)
+    if unused:
+        raise TemplateError(f'{template_name}: unused variables {", ".join(unused)}')
+
+    template = {}
+    for section in templating.SECTIONS:
+        if section in merged:
+            template[section] = merged[section]
+        elif section in layout:
+            template[section] = layout[section]
+    return template
+
+
+def function(node):
+    # Short and long form functions, e.g. !Ref X and Ref: X
+    if isinstance(node, Function):
+        name = node.tag[1:]
+        return ('Ref' if name == 'Ref' else f'Fn::{name}'), node.value
+    if isinstance(node, dict) and len(node) == 1:
+        name, value = next(iter(node.items()))
+        if name == 'Ref' or name.startswith('Fn::') or name == 'Condition':
+            return name, value
+    return None, None
+
+
+def sub_references(value):
+    if isinstance(value, list):
+        text, local = value[0], value[1] if len(value) > 1 else {}
+    else:
+        text, local = value, {}
+    if not isinstance(text, str):
+        return []
+    return [name for name in SUB_VARIABLE.findall(text) if name not in local]
+
+
+def find_references(node, names, resources, conditions, problems, path):
+    name, value = function(node)
+    if name == 'Ref':
+        if value not in names:
+            problems.append(f'{path}: !Ref {value}')
+    elif name == 'Fn::GetAtt':
+        resource = value.split('.')[0] if isinstance(value, str) else value[0]
+        if resource not in resources:
+            problems.append(f'{path}: !GetAtt {resource}')
+    elif name == 'Fn::Sub':
+        for reference in sub_references(value):
+            if reference.split('.')[0] not in (resources if '.' in reference else names):
+                problems.append(f'{path}: ${{{reference}}}')
+    elif name == 'Fn::If':
+        if value[0] not in conditions:
+            problems.append(f'{path}: condition {value[0]}')
+    elif name in ('Condition', 'Fn::Condition'):
+        if value not in conditions:
+            problems.append(f'{path}: condition {value}')
+
+    if isinstance(node, Function):
+        node = node.value
+    if isinstance(node, dict):
+        for key, child in node.items():
+            find_references(child, names, resources, conditions, problems, f'{path}.{key}')
+    elif isinstance(node, list):
+        for index, child in enumerate(node):
+            find_references(child, names, resources, conditions, problems, f'{path}[{index}]')
+    elif isinstance(node, Variable):
+        problems.append(f'{path}: !Var {node.name}')
+
+
+def check_references(template, template_name):
+    # Catches references to missing parameters, resources and conditions before anything is sent to AWS
+    resources = set(template.get('Resources') or {})
+    conditions = set(template.get('Conditions') or {})
+    names = resources | set(template.get('Parameters') or {}) | set(templating.PSEUDO_PARAMETERS)
+
+    problems = []
+    for section in ['Conditions', 'Resources', 'Outputs']:
+        for key, entry in (template.get(section) or {}).items():
+            path = f'{section}.{key}'
+            find_references(entry, names, resources, conditions, problems, path)
+            if section == 'Conditions' or not isinstance(entry, dict):
+                continue
+
+            condition = entry.get('Condition')
+            if condition is not None and condition not in conditions:
+                problems.append(f'{path}: condition {condition}')
+            depends_on = entry.get('DependsOn', [])
+            for dependency in [depends_on] if isinstance(depends_on, str) else depends_on:
+                if dependency not in resources:
+                    problems.append(f'{path}: DependsOn {dependency}')
+
+    if problems:
+        raise TemplateError(f'{template_name} has broken references: {"; ".join(problems)}')
+
+
+@functools.lru_cache(maxsize=None)
+def render_template(template_name):
+    # Layouts list the components they are made of, templates without components are used as written
+    text = read_resource(template_name)
+    layout = load_yaml(text)
+    if templating.COMPONENTS_KEY not in layout:
+        check_references(layout, template_name)
+        return text
+
+    template = compose(layout, template_name)
+    check_references(template, template_name)
+    return dump_template(template)
+
+
+def validated_path(digest):
+    return os.path.join(os.path.expanduser(misc.CACHE_DIR), templating.VALIDATED_DIR, digest)
+
+
+def is_validated(digest):
+    return os.path.exists(validated_path(digest))
+
+
+def mark_validated(digest):
+    path = validated_path(digest)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, 'w').close()
+    except OSError:
+        pass
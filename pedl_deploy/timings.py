@@ -0,0 +1,113 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+
+from pedl_deploy.constants import stack_events, timing
+
+_lock = threading.Lock()
+# Kept per region and scope, since --regions deploys a stack of the same name to every region
+_phases = {}
+_events = {}
+
+
+@contextmanager
+def phase(region, scope, name):
+    start = time.time()
+    try:
+        yield
+    finally:
+        with _lock:
+            phases = _phases.setdefault((region, scope), {})
+            phases[name] = phases.get(name, 0) + time.time() - start
+
+
+def record_event(region, stack_name, event):
+    with _lock:
+        _events.setdefault((region, stack_name), []).append(event)
+
+
+def clear(region, scopes):
+    with _lock:
+        for scope in scopes:
+            _phases.pop((region, scope), None)
+            _events.pop((region, scope), None)
+
+
+def resource_durations(events):
+    resources = {}
+    for event in events:
+        if event['ResourceType'] == stack_events.STACK_RESOURCE_TYPE:
+            continue
+
+        resource = resources.setdefault(event['LogicalResourceId'], {
+            'logical_id': event['LogicalResourceId'],
+            'type': event['ResourceType'],
+            'start': event['Timestamp'],
+            'end': None,
+            'critical': False
+        })
+        if not event['ResourceStatus'].endswith('_IN_PROGRESS'):
+            resource['end'] = event['Timestamp']
+            resource['status'] = event['ResourceStatus']
+
+    finished = [resource for resource in resources.values() if resource['end'] is not None]
+    for resource in finished:
+        resource['duration'] = (resource['end'] - resource['start']).total_seconds()
+    mark_critical_path(finished)
+    return sorted(finished, key=lambda resource: resource['start'])
+
+
+def mark_critical_path(resources):
+    # CloudFormation starts a resource as soon as its dependencies are done, so the resource that
+    # finished last before another one started is taken to be what it waited on.
+    if not resources:
+        return
+
+    current = max(resources, key=lambda resource: resource['end'])
+    while current is not None:
+        current['critical'] = True
+        candidates = [resource for resource in resources if not resource['critical'] and
+                      (resource['end'] - current['start']).total_seconds() <= timing.CRITICAL_PATH_TOLERANCE]
+        current = max(candidates, key=lambda resource: resource['end'], default=None)
+
+
+def report():
+    # Maps (region, scope) to the phases and resource durations of the scope
+    with _lock:
+        phases = {key: dict(values) for key, values in _phases.items()}
+        events = {key: list(values) for key, values in _events.items()}
+
+    result = {}
+    for key in list(phases) + [key for key in events if key not in phases]:
+        result[key] = {
+            'phases': phases.get(key, {}),
+            'resources': resource_durations(events.get(key, []))
+        }
+    return result
+
+
+def print_report():
+    for (region, scope), values in report().items():
+        print()
+        print(f'Timings for {scope} in {region}')
+        for name, seconds in values['phases'].items():
+            print(f'  {name:<16} {seconds:8.1f}s')
+
+        if values['resources']:
+            print('  Resources (* on the critical path)')
+            for resource in values['resources']:
+                marker = '*' if resource['critical'] else ' '
+                print(f'  {marker} {resource["duration"]:8.1f}s  {resource["logical_id"]} ({resource["type"]})')
+
+
+def write_json(path):
+    scopes = []
+    for (region, scope), values in report().items():
+        for resource in values['resources']:
+            resource['start'] = resource['start'].isoformat()
+            resource['end'] = resource['end'].isoformat()
+        scopes.append({'region': region, 'scope': scope, **values})
+
+    with open(path, 'w') as f:
+        json.dump({'created': time.time(), 'timings': scopes}, f, indent=2)
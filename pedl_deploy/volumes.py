@@ -0,0 +1,67 @@
+from pedl_deploy.clients import client
+from pedl_deploy.constants import volumes
+
+
+def parse_volume(spec):
+    # e.g. size=500,type=gp3,iops=6000,throughput=500
+    volume = {}
+    for item in spec.split(','):
+        if not item.strip():
+            continue
+        key, separator, value = item.partition('=')
+        key = key.strip()
+        if not separator or key not in volumes.KEYS:
+            raise ValueError(f'Invalid volume setting {item.strip()}, expected a comma separated list of '
+                             f'{", ".join(key + "=" for key in volumes.KEYS)}')
+        volume[key] = value.strip()
+    return volume
+
+
+def optional_int(value):
+    return None if value is None else int(value)
+
+
+def volume_settings(volume, size):
+    settings = {
+        volumes.SIZE: int(volume.get(volumes.SIZE, size)),
+        volumes.TYPE: volume.get(volumes.TYPE) or volumes.DEFAULT_TYPE,
+        volumes.IOPS: optional_int(volume.get(volumes.IOPS)),
+        volumes.THROUGHPUT: optional_int(volume.get(volumes.THROUGHPUT))
+    }
+
+    volume_type = settings[volumes.TYPE]
+    if volume_type not in volumes.TYPES:
+        raise ValueError(f'Invalid volume type {volume_type}, must be one of {", ".join(volumes.TYPES)}')
+    if settings[volumes.SIZE] <= 0:
+        raise ValueError('The volume size must be positive')
+
+    for key, limits in [(volumes.IOPS, volumes.IOPS_LIMITS), (volumes.THROUGHPUT, volumes.THROUGHPUT_LIMITS)]:
+        value = settings[key]
+        if value is None:
+            continue
+        if volume_type not in limits:
+            raise ValueError(f'{volume_type} volumes do not take the {key} setting')
+        low, high = limits[volume_type]
+        if not low <= value <= high:
+            raise ValueError(f'The {key} of {volume_type} volumes must be between {low} and {high}')
+
+    iops = settings[volumes.IOPS] or volumes.DEFAULT_IOPS
+    if (settings[volumes.THROUGHPUT] or 0) > iops * volumes.MAX_THROUGHPUT_PER_IOPS:
+        raise ValueError(f'A throughput of {settings[volumes.THROUGHPUT]} MiB/s needs at least '
+                         f'{int(settings[volumes.THROUGHPUT] / volumes.MAX_THROUGHPUT_PER_IOPS)} iops')
+    return settings
+
+
+def set_master_throughput(instance, throughput, boto3_session):
+    # AWS::EC2::Instance has no throughput setting for its volumes, so it is changed in place after the deploy
+    root_device = instance['RootDeviceName']
+    volume_id = next(mapping['Ebs']['VolumeId'] for mapping in instance['BlockDeviceMappings']
+                     if mapping['DeviceName'] == root_device)
+
+    ec2 = client(boto3_session, 'ec2')
+    volume = ec2.describe_volumes(VolumeIds=[volume_id])['Volumes'][0]
+    if volume.get('Throughput') == throughput:
+        return
+
+    ec2.modify_volume(VolumeId=volume_id, Throughput=throughput)
+    print(f'Changing the throughput of the master volume {volume_id} to {throughput} MiB/s')
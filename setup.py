@@ -5,6 +5,7 @@ setup(
     version='0.1',
     packages=find_packages(),
     include_package_data=True,
+    python_requires='>=3.9',
     install_requires=[
         'boto3',
         'pyyaml',